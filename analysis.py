@@ -0,0 +1,394 @@
+import json
+import os
+import queue
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import profiling
+
+# Pool of Stockfish processes for analysis. Every worker thread owns one engine and takes requests off a bounded
+# queue, so callers never block on the engine: analyse() hands back a Future (analyseAsync() awaits it from asyncio).
+# Nothing is started until the first request, a request that runs past its timeout gets its engine killed, and a
+# worker whose engine died restarts it before taking the next request.
+# An AnalysisCache in front of the pool answers positions that were already searched deep enough without
+# touching an engine at all.
+
+# Where the engine comes from, first match wins:
+#   STOCKFISH_PATH / STOCKFISH_PARAMETERS (a JSON object) environment variables
+#   "path" / "parameters" in the JSON file named by CHESS_ENGINE_CONFIG (engine.json next to this module by default)
+#   stockfish/stockfish in this directory, then stockfish on the PATH
+# The analysis cache's SQLite file is CHESS_ANALYSIS_CACHE, then "cache" in that same JSON file, then
+# data/analysis-cache.sqlite in this directory.
+STOCKFISH_PARAMETERS = {"Threads": 1, "Skill Level": 10}
+DEFAULT_DEPTH = 15
+moduleDir = os.path.dirname(os.path.abspath(__file__))
+defaultCachePath = os.path.join(moduleDir, 'data', 'analysis-cache.sqlite')
+# engine options that change speed but not the answer, left out of cache keys
+PERFORMANCE_OPTIONS = ('Threads', 'Hash')
+
+
+class AnalysisError(Exception):
+    pass
+
+
+class QueueFull(AnalysisError):
+    # raised by analyse() instead of letting requests pile up without bound
+    pass
+
+
+class AnalysisTimeout(AnalysisError):
+    pass
+
+
+class PoolClosed(AnalysisError):
+    pass
+
+
+class EngineNotFound(AnalysisError):
+    pass
+
+
+def readConfig():
+    # the JSON config file as a dict, empty when there isn't one
+    configPath = os.environ.get('CHESS_ENGINE_CONFIG', os.path.join(moduleDir, 'engine.json'))
+    if not os.path.exists(configPath):
+        return {}
+    with open(configPath) as f:
+        return json.load(f)
+
+
+def engineConfig():
+    # (path or None, parameters), read every time so a long-running process picks up a changed environment
+    config = readConfig()
+    parameters = dict(STOCKFISH_PARAMETERS)
+    parameters.update(config.get('parameters', {}))
+    if os.environ.get('STOCKFISH_PARAMETERS'):
+        parameters.update(json.loads(os.environ['STOCKFISH_PARAMETERS']))
+    path = os.environ.get('STOCKFISH_PATH') or config.get('path')
+    if not path:
+        bundled = os.path.join(moduleDir, 'stockfish', 'stockfish')
+        path = bundled if os.path.isfile(bundled) else shutil.which('stockfish')
+    return path, parameters
+
+
+def analysisCachePath():
+    return os.environ.get('CHESS_ANALYSIS_CACHE') or readConfig().get('cache') or defaultCachePath
+
+
+def infoScore(info, fen):
+    # {'centipawns', 'mate'} from the engine's last UCI info line, converted from the side to move's point of view
+    # to white's like get_top_moves reports them. Empty when the line has no score.
+    words = info.split()
+    if 'score' not in words:
+        return {}
+    kind, value = words[words.index('score') + 1:words.index('score') + 3]
+    value = int(value) if fen.split()[1] == 'w' else -int(value)
+    return {'centipawns': value if kind == 'cp' else None, 'mate': value if kind == 'mate' else None}
+
+
+def normalizeFEN(fen):
+    # placement, side to move, castling and en passant decide the analysis, the move clocks don't
+    return ' '.join(fen.split()[:4])
+
+
+class AnalysisCache:
+    # Two tiers: an LRU dict of recent results in memory and an SQLite table on disk that survives restarts.
+    # Entries are keyed by normalized FEN and the engine options. Each key keeps only its deepest result, which also
+    # answers every shallower request.
+    def __init__(self, path=None, memorySize=4096):
+        self.memory = OrderedDict()
+        self.memorySize = memorySize
+        self.lock = threading.Lock()
+        self.hits = self.memoryHits = self.diskHits = self.misses = 0
+        self.db = None
+        if path is not None:
+            import sqlite3
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS analysis (position TEXT, options TEXT, depth INTEGER, "
+                            "result TEXT, PRIMARY KEY (position, options))")
+            self.db.commit()
+
+    def get(self, fen, depth, options=''):
+        key = (normalizeFEN(fen), options)
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and entry[0] >= depth:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                self.memoryHits += 1
+                return dict(entry[1], fen=fen)
+            if self.db is not None:
+                row = self.db.execute("SELECT depth, result FROM analysis WHERE position = ? AND options = ?",
+                                      key).fetchone()
+                if row is not None and row[0] >= depth:
+                    result = json.loads(row[1])
+                    self.remember(key, row[0], result)
+                    self.hits += 1
+                    self.diskHits += 1
+                    return dict(result, fen=fen)
+            self.misses += 1
+            return None
+
+    def put(self, fen, depth, result, options=''):
+        key = (normalizeFEN(fen), options)
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and entry[0] > depth:
+                return
+            self.remember(key, depth, result)
+            if self.db is not None:
+                self.db.execute("INSERT INTO analysis VALUES (?, ?, ?, ?) ON CONFLICT (position, options) DO UPDATE "
+                                "SET depth = excluded.depth, result = excluded.result WHERE excluded.depth >= depth",
+                                key + (depth, json.dumps(result)))
+                self.db.commit()
+
+    def remember(self, key, depth, result):
+        self.memory[key] = (depth, result)
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memorySize:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'memoryHits': self.memoryHits, 'diskHits': self.diskHits,
+                    'misses': self.misses, 'memoryEntries': len(self.memory)}
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+
+class StockfishPool:
+    def __init__(self, size=None, path=None, parameters=None, queueSize=64, timeout=30.0, cache=None, bitbases=None):
+        # path and parameters default to engineConfig(). Positions the bitbases (bitbases.Bitbases) cover are
+        # answered from them without asking the engine
+        self.size = size or os.cpu_count() or 1
+        configPath, configParameters = engineConfig()
+        self.path = path or configPath
+        self.parameters = dict(configParameters if parameters is None else parameters)
+        self.cache = cache
+        self.bitbases = bitbases
+        self.cacheOptions = json.dumps({k: v for k, v in self.parameters.items() if k not in PERFORMANCE_OPTIONS},
+                                       sort_keys=True)
+        self.timeout = timeout
+        self.requests = queue.Queue(queueSize)
+        self.workers = []
+        self.lock = threading.Lock()
+        self.closed = False
+        self.enginesStarted = 0  # includes restarts after a crash or timeout
+
+    def start(self):
+        with self.lock:
+            if self.closed:
+                raise PoolClosed()
+            while len(self.workers) < self.size:
+                worker = threading.Thread(target=self.work, name='stockfish-%d' % len(self.workers), daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def analyse(self, fen, depth=None, movetime=None, timeout=None):
+        # movetime is in seconds, depth is used when movetime isn't given (DEFAULT_DEPTH when neither is).
+        # Only fixed-depth results go through the cache, a movetime search reaches a different depth on every machine.
+        if movetime is None:
+            depth = depth or DEFAULT_DEPTH
+        result = self.known(fen, depth, movetime)
+        if result is not None:
+            future = Future()
+            future.set_result(result)
+            return future
+        future = self.submit(fen, depth, movetime, timeout)
+        if movetime is None and self.cache is not None:
+            future.add_done_callback(self.cacheResult)
+        return future
+
+    def analyseBatch(self, fens, depth=None, movetime=None, timeout=None):
+        # a Future for the results of several positions, in order. The ones not in the cache go to one engine as a
+        # single request and are searched one after the other without clearing its hash table in between, so
+        # consecutive positions of a game reuse what the previous search found. timeout applies to each position.
+        if movetime is None:
+            depth = depth or DEFAULT_DEPTH
+        results = [self.known(fen, depth, movetime) for fen in fens]
+        missing = [i for i, result in enumerate(results) if result is None]
+        future = Future()
+        if not missing:
+            future.set_result(results)
+            return future
+        engineFuture = self.submit([fens[i] for i in missing], depth, movetime, timeout)
+
+        def merge(done):
+            if done.exception() is not None:
+                future.set_exception(done.exception())
+                return
+            for i, result in zip(missing, done.result()):
+                results[i] = result
+                if movetime is None and self.cache is not None:
+                    self.cache.put(result['fen'], result['depth'], result, self.cacheOptions)
+            future.set_result(results)
+        engineFuture.add_done_callback(merge)
+        return future
+
+    def known(self, fen, depth, movetime):
+        # a result that needs no engine: solved by the bitbases or, for fixed-depth requests, in the cache
+        if self.bitbases is not None:
+            result = self.bitbases.analysis(fen)
+            if result is not None:
+                if profiling.current is not None:
+                    profiling.current.count('bitbaseHits')
+                result['depth' if movetime is None else 'movetime'] = depth if movetime is None else movetime
+                return result
+        return self.cached(fen, depth) if movetime is None else None
+
+    def cached(self, fen, depth):
+        result = self.cache.get(fen, depth, self.cacheOptions) if self.cache is not None else None
+        if result is not None and profiling.current is not None:
+            profiling.current.count('engineCacheHits')
+        return result
+
+    def submit(self, fen, depth, movetime, timeout):
+        # queues a request for the workers, fen is one FEN or a list of them for analyseBatch
+        if not self.workers:
+            self.start()
+        if self.closed:
+            raise PoolClosed()
+        future = Future()
+        request = (future, fen, depth, movetime, self.timeout if timeout is None else timeout)
+        try:
+            self.requests.put_nowait(request)
+        except queue.Full:
+            raise QueueFull("%d analysis requests already waiting" % self.requests.maxsize) from None
+        prof = profiling.current
+        if prof is not None:
+            # the profile active when the request was made gets the time until the answer, queueing included
+            future.add_done_callback(profiling.engineTimer(prof))
+        return future
+
+    def cacheResult(self, future):
+        if not future.cancelled() and future.exception() is None:
+            result = future.result()
+            self.cache.put(result['fen'], result['depth'], result, self.cacheOptions)
+
+    async def analyseAsync(self, fen, depth=None, movetime=None, timeout=None):
+        import asyncio
+        return await asyncio.wrap_future(self.analyse(fen, depth, movetime, timeout))
+
+    def work(self):
+        stockfish = None
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            future = request[0]
+            if not future.set_running_or_notify_cancel():
+                continue
+            if stockfish is None or not self.isAlive(stockfish):
+                try:
+                    stockfish = self.newEngine()
+                except Exception as e:
+                    future.set_exception(e)
+                    stockfish = None
+                    continue
+            try:
+                fen, depth, movetime, timeout = request[1:]
+                if isinstance(fen, list):
+                    future.set_result([self.run(stockfish, position, depth, movetime, timeout, newGame=i == 0)
+                                       for i, position in enumerate(fen)])
+                else:
+                    future.set_result(self.run(stockfish, fen, depth, movetime, timeout))
+            except AnalysisTimeout as e:
+                future.set_exception(e)
+                stockfish = None
+            except Exception as e:
+                # the engine crashed (or the library did), start a fresh one for the next request
+                future.set_exception(AnalysisError("stockfish failed on %s: %r" % (request[1], e)))
+                self.quit(stockfish)
+                stockfish = None
+        self.quit(stockfish)
+
+    def newEngine(self):
+        if not self.path or not os.path.isfile(self.path):
+            raise EngineNotFound("no stockfish binary at %r, set STOCKFISH_PATH or the path in %s" %
+                                 (self.path, os.environ.get('CHESS_ENGINE_CONFIG', 'engine.json')))
+        from stockfish import Stockfish
+        with self.lock:
+            self.enginesStarted += 1
+        return Stockfish(path=self.path, parameters=self.parameters)
+
+    def run(self, stockfish, fen, depth, movetime, timeout, newGame=True):
+        # the library blocks on the engine's output, so a timer kills the process to unblock it when time is up
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            self.quit(stockfish)
+        timer = threading.Timer(timeout, expire) if timeout else None
+        if timer is not None:
+            timer.start()
+        try:
+            # ucinewgame clears the engine's hash, which is only wanted when the position isn't a continuation
+            stockfish.set_fen_position(fen, newGame)
+            if movetime is not None:
+                bestMove = stockfish.get_best_move_time(max(1, int(movetime * 1000)))
+                result = {'fen': fen, 'bestmove': bestMove, 'movetime': movetime}
+                result.update(infoScore(getattr(stockfish, 'info', ''), fen))
+            else:
+                stockfish.set_depth(depth)
+                top = stockfish.get_top_moves(1)
+                result = {'fen': fen, 'bestmove': top[0]['Move'] if top else None, 'depth': depth}
+                if top:
+                    result['centipawns'] = top[0]['Centipawn']
+                    result['mate'] = top[0]['Mate']
+        except Exception:
+            if expired.is_set():
+                raise AnalysisTimeout("no result for %s after %.1fs" % (fen, timeout))
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if expired.is_set():
+            raise AnalysisTimeout("no result for %s after %.1fs" % (fen, timeout))
+        return result
+
+    def isAlive(self, stockfish):
+        process = getattr(stockfish, '_stockfish', None)
+        return process is not None and process.poll() is None
+
+    def quit(self, stockfish):
+        process = getattr(stockfish, '_stockfish', None)
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def close(self):
+        # stops the workers once the requests already queued are done
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            workers = self.workers
+        for _ in workers:
+            self.requests.put(None)
+        for worker in workers:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_defaultPool = None
+_defaultPoolLock = threading.Lock()
+
+
+def defaultPool():
+    global _defaultPool
+    with _defaultPoolLock:
+        if _defaultPool is None:
+            import bitbases
+            _defaultPool = StockfishPool(cache=AnalysisCache(analysisCachePath()), bitbases=bitbases.defaultBitbases())
+        return _defaultPool
@@ -0,0 +1,6 @@
+from bitboard import BitboardGameState
+from engine import GameState
+
+# GameState implementations by name, for the tools that take a --backend option (perft, pgn, parallel, positions).
+# Both share the makeMove/undoMove/getValid API; only the bitboard one can generate packed moves.
+backends = {'numpy': GameState, 'bitboard': BitboardGameState}
@@ -0,0 +1,197 @@
+import numpy as np
+
+from engine import pieceLetters
+from search import pieceValues, pieceSquareTables
+
+# Batch encoding of many positions into NumPy arrays, for analytics and ML features.
+# pieces is an (N, 12, 8, 8) bool tensor with one plane per piece in pieceNames order, indexed [row][col] like
+# GameState.board (row 0 is rank 8). Everything below works on whole batches with array operations, the only Python
+# loops are per position (splitting the FEN) or per direction/piece type, never per square. Attacks are computed
+# on uint64 bitboards, eight bytes per position instead of 64.
+
+pieceNames = ['wp', 'wn', 'wb', 'wr', 'wq', 'wk', 'bp', 'bn', 'bb', 'br', 'bq', 'bk']
+castleNames = ['wks', 'wqs', 'bks', 'bqs']
+
+# byte value of a FEN letter -> plane, 12 for an empty square
+_planeOf = np.full(256, 12, dtype=np.uint8)
+for _plane, _piece in enumerate(pieceNames):
+    _planeOf[ord(pieceLetters[_piece])] = _plane
+# expands the digits of a FEN placement to that many dots and drops the '/', giving 64 characters
+_expand = {ord(str(n)): '.' * n for n in range(1, 9)}
+_expand[ord('/')] = None
+
+values = np.array([pieceValues[name[1]] for name in pieceNames], dtype=np.int32)
+
+
+def signedTable(name):
+    # piece-square table plus material, negated for black, which reads the white table mirrored top to bottom
+    table = np.array(pieceSquareTables[name[1]]) + pieceValues[name[1]]
+    return table if name[0] == 'w' else -table[::-1]
+
+
+pstTables = np.array([signedTable(name) for name in pieceNames], dtype=np.int32)
+
+rookSteps = ((-1, 0), (0, -1), (1, 0), (0, 1))
+bishopSteps = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+knightSteps = ((-1, -2), (-2, -1), (-1, 2), (-2, 1), (1, 2), (2, 1), (1, -2), (2, -1))
+kingSteps = rookSteps + bishopSteps
+
+
+def encodeFENs(fens):
+    # dict of arrays: pieces (N, 12, 8, 8) bool, whiteMove (N,) bool, castling (N, 4) bool in castleNames order,
+    # enPassant (N, 8, 8) bool with the en passant target square set
+    fens = list(fens)
+    fields = [fen.split() for fen in fens]
+    placement = ''.join(f[0].translate(_expand) for f in fields).encode('ascii')
+    if len(placement) != 64 * len(fens):
+        raise ValueError("bad FEN placement in batch")
+    squares = _planeOf[np.frombuffer(placement, dtype=np.uint8)].reshape(len(fens), 64)
+    pieces = (squares[:, None, :] == np.arange(12, dtype=np.uint8)[None, :, None]).reshape(len(fens), 12, 8, 8)
+    whiteMove = np.array([len(f) < 2 or f[1] == 'w' for f in fields], dtype=bool)
+    castlingText = [f[2] if len(f) > 2 else '-' for f in fields]
+    castling = np.array([['K' in c, 'Q' in c, 'k' in c, 'q' in c] for c in castlingText], dtype=bool).reshape(-1, 4)
+    enPassant = np.zeros((len(fens), 64), dtype=bool)
+    for i, f in enumerate(fields):
+        if len(f) > 3 and f[3] != '-':
+            enPassant[i, (8 - int(f[3][1])) * 8 + ord(f[3][0]) - ord('a')] = True
+    return {'pieces': pieces, 'whiteMove': whiteMove, 'castling': castling,
+            'enPassant': enPassant.reshape(len(fens), 8, 8)}
+
+
+def encodeStates(states):
+    # same as encodeFENs for GameState objects (either backend), without going through FEN text
+    states = list(states)
+    boards = np.array([gs.board for gs in states], dtype='<U2').reshape(len(states), 8, 8)
+    pieces = boards[:, None, :, :] == np.array(pieceNames)[None, :, None, None]
+    whiteMove = np.array([gs.whiteMove for gs in states], dtype=bool)
+    castling = np.array([[getattr(gs.currentCastleRights, name) for name in castleNames] for gs in states],
+                        dtype=bool).reshape(-1, 4)
+    enPassant = np.zeros((len(states), 8, 8), dtype=bool)
+    for i, gs in enumerate(states):
+        if gs.possibleEnPassant:
+            enPassant[i][gs.possibleEnPassant] = True
+    return {'pieces': pieces, 'whiteMove': whiteMove, 'castling': castling, 'enPassant': enPassant}
+
+
+def toPlanes(encoded):
+    # single (N, 18, 8, 8) uint8 tensor: 12 piece planes, side to move, 4 castling rights, en passant
+    n = len(encoded['whiteMove'])
+    flags = np.concatenate([encoded['whiteMove'][:, None], encoded['castling']], axis=1)
+    return np.concatenate([encoded['pieces'], np.broadcast_to(flags[:, :, None, None], (n, 5, 8, 8)),
+                           encoded['enPassant'][:, None]], axis=1).astype(np.uint8)
+
+
+def materialCounts(pieces):
+    # (N, 12) number of each piece
+    return pieces.sum(axis=(2, 3), dtype=np.int32)
+
+
+def materialBalance(pieces):
+    # (N,) white material minus black material in centipawns
+    counts = materialCounts(pieces)
+    return counts[:, :6] @ values[:6] - counts[:, 6:] @ values[6:]
+
+
+def pstEval(pieces):
+    # (N,) material + piece-square score from white's point of view, the same numbers search.evaluate adds up
+    return np.einsum('npij,pij->n', pieces.astype(np.int32), pstTables)
+
+
+def toBitboards(pieces):
+    # (N, 12) uint64, bit row*8 + col set for every piece, the numbering bitboard.py uses
+    n = len(pieces)
+    packed = np.packbits(pieces.reshape(n, 12, 64), axis=-1, bitorder='little')
+    return np.ascontiguousarray(packed).view('<u8').reshape(n, 12)
+
+
+def toBoards(bitboards):
+    # inverse of toBitboards for any (..., ) uint64 array, giving (..., 8, 8) bool
+    bits = np.unpackbits(np.ascontiguousarray(bitboards, dtype='<u8').view(np.uint8).reshape(bitboards.shape + (8,)),
+                         axis=-1, bitorder='little')
+    return bits.reshape(bitboards.shape + (8, 8)).astype(bool)
+
+
+# (shift, mask) per (dr, dc): shifting by dr*8 + dc moves a square by (dr, dc), the mask drops the squares that
+# wrapped around into the wrong file
+_files = [np.uint64(sum(1 << (r * 8 + c) for r in range(8))) for c in range(8)]
+
+
+def stepShift(dr, dc):
+    mask = ~np.uint64(0)
+    for c in range(8):
+        if not 0 <= c - dc < 8:
+            mask &= ~_files[c]
+    return dr * 8 + dc, mask
+
+
+def shiftBits(bitboards, amount):
+    if amount >= 0:
+        return bitboards << np.uint64(amount)
+    return bitboards >> np.uint64(-amount)
+
+
+def stepAttacks(bitboards, steps):
+    # (N, len(steps)) attacked squares, one set per step
+    shifts = [stepShift(dr, dc) for dr, dc in steps]
+    return np.stack([shiftBits(bitboards, amount) & mask for amount, mask in shifts], axis=-1)
+
+
+def slideAttacks(bitboards, steps, empty):
+    # (N, len(steps)) attacked squares, one set per direction. Kogge-Stone fill: the sliders spread through empty
+    # squares in three doubling steps, the first occupied square on every ray is attacked as well.
+    attacks = []
+    for dr, dc in steps:
+        amount, mask = stepShift(dr, dc)
+        generate = bitboards
+        propagate = empty & mask
+        generate = generate | (propagate & shiftBits(generate, amount))
+        propagate = propagate & shiftBits(propagate, amount)
+        generate = generate | (propagate & shiftBits(generate, 2 * amount))
+        propagate = propagate & shiftBits(propagate, 2 * amount)
+        generate = generate | (propagate & shiftBits(generate, 4 * amount))
+        attacks.append(shiftBits(generate, amount) & mask)
+    return np.stack(attacks, axis=-1)
+
+
+def directionAttacks(pieces):
+    # list of 12 (N, k) uint64 arrays, the squares each piece type attacks split by step/direction. Within one
+    # direction the sets of two pieces of the same type can only meet on the nearer piece's own square (it blocks
+    # the farther one's ray), so counting bits per direction counts every (piece, target) pair once.
+    bitboards = toBitboards(pieces)
+    empty = ~np.bitwise_or.reduce(bitboards, axis=1)
+    attacks = [None] * 12
+    attacks[0] = stepAttacks(bitboards[:, 0], ((-1, -1), (-1, 1)))
+    attacks[6] = stepAttacks(bitboards[:, 6], ((1, -1), (1, 1)))
+    for base in (0, 6):
+        attacks[base + 1] = stepAttacks(bitboards[:, base + 1], knightSteps)
+        attacks[base + 2] = slideAttacks(bitboards[:, base + 2], bishopSteps, empty)
+        attacks[base + 3] = slideAttacks(bitboards[:, base + 3], rookSteps, empty)
+        attacks[base + 4] = slideAttacks(bitboards[:, base + 4], kingSteps, empty)
+        attacks[base + 5] = stepAttacks(bitboards[:, base + 5], kingSteps)
+    return attacks
+
+
+def pieceAttacks(pieces):
+    # (N, 12, 8, 8) uint8: for every piece type, how many pieces of that type attack each square
+    return np.stack([toBoards(a).sum(axis=1, dtype=np.uint8) for a in directionAttacks(pieces)], axis=1)
+
+
+def attackMaps(pieces):
+    # (N, 2, 8, 8) bool: squares attacked by white and by black
+    attacks = [np.bitwise_or.reduce(a, axis=1) for a in directionAttacks(pieces)]
+    white = np.bitwise_or.reduce(np.stack(attacks[:6], axis=1), axis=1)
+    black = np.bitwise_or.reduce(np.stack(attacks[6:], axis=1), axis=1)
+    return toBoards(np.stack([white, black], axis=1))
+
+
+def mobility(pieces):
+    # (N, 2) pseudo-legal knight, bishop, rook and queen moves for white and black: squares they attack that
+    # aren't occupied by their own side. Pins and checks are ignored, so it's an approximation.
+    attacks = directionAttacks(pieces)
+    bitboards = toBitboards(pieces)
+    result = np.zeros((len(pieces), 2), dtype=np.int32)
+    for color, base in ((0, 0), (1, 6)):
+        own = np.bitwise_or.reduce(bitboards[:, base:base + 6], axis=1)[:, None]
+        for t in range(base + 1, base + 5):
+            result[:, color] += np.bitwise_count(attacks[t] & ~own).sum(axis=1, dtype=np.int32)
+    return result
@@ -0,0 +1,370 @@
+import argparse
+import mmap
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import engine
+import movecode
+from bitboard import BitboardGameState
+from movecode import KIND_MASK, PROMOTION
+from tables import kingAttacks
+
+# Win/draw/loss tables for king + queen, rook or pawn against a lone king, solved by retrograde analysis.
+# A table has one entry per (side to move, strong king, weak king, piece square), indexed
+#   ((weakToMove * 64 + strongKing) * 64 + weakKing) * 64 + pieceSquare
+# with the strong side as white. Positions where black has the piece are probed with the board flipped and the
+# colours swapped. <name>.wdl holds 2 bits per entry (0 illegal, 1 draw, 2 side to move wins, 3 side to move loses),
+# 128 KB a table, and the optional <name>.dtm one byte per entry with the plies to mate. Probes memory-map the files
+# and read a single byte.
+#
+# Building generates the moves of every legal position with BitboardGameState.generateMoves, one process per strong
+# king square, then works back from the mates: a position with white to move is won as soon as one move reaches a
+# lost position, one with black to move is lost once every move reaches a won one. Pawn promotions continue in the
+# queen and rook tables, so KPK is solved after those. Castling rights aren't covered, positions that have them aren't
+# probed.
+
+SIZE = 2 * 64 * 64 * 64
+HALF = SIZE // 2
+ILLEGAL, DRAW, WIN, LOSS = 0, 1, 2, 3
+MAX_PIECES = 3  # kings included
+order = ('KQK', 'KRK', 'KPK')  # KPK promotes into the first two
+pieceOf = {'KQK': 'q', 'KRK': 'r', 'KPK': 'p'}
+tableOf = {piece: name for name, piece in pieceOf.items()}
+promotionTables = {movecode.promotionPieces.index(piece): order.index(tableOf[piece]) for piece in 'qr'}
+wdlOf = {DRAW: 0, WIN: 1, LOSS: -1}
+BITBASE_CENTIPAWNS = 10000  # reported by analysis for a won position when there is no .dtm file
+defaultDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bitbases')
+
+
+def index(weakToMove, strongKing, weakKing, sq):
+    return ((weakToMove * 64 + strongKing) * 64 + weakKing) * 64 + sq
+
+
+def positionIndex(rows, whiteMove):
+    # (table name, index) for a position the tables cover, ('draw', None) for bare kings or kings and one minor
+    # piece, None for everything else
+    found = []
+    for r, row in enumerate(rows):
+        for c, piece in enumerate(row):
+            if piece != '--':
+                if len(found) == 3:
+                    return None
+                found.append((piece, r * 8 + c))
+    kings = {piece[0]: sq for piece, sq in found if piece[1] == 'k'}
+    others = [(piece, sq) for piece, sq in found if piece[1] != 'k']
+    if len(kings) != 2:
+        return None
+    if not others or others[0][0][1] in 'nb':
+        return 'draw', None
+    (piece, sq), = others
+    if piece[0] == 'w':
+        return tableOf[piece[1]], index(0 if whiteMove else 1, kings['w'], kings['b'], sq)
+    # black has the piece: flip the board so it becomes white's
+    return tableOf[piece[1]], index(1 if whiteMove else 0, kings['b'] ^ 56, kings['w'] ^ 56, sq ^ 56)
+
+
+def tableMoves(task):
+    # process pool worker: every legal position of a table with the strong king on one square and the moves out of
+    # them. Returns (legal indexes, in check, move counts, internal move sources, targets, and for promotions into
+    # another table the sources, table numbers and target indexes)
+    name, strongKing = task
+    piece = 'w' + pieceOf[name]
+    pawn = piece == 'wp'
+    gs = BitboardGameState("8/8/8/8/8/8/8/8 w - - 0 1")
+    placed = ()
+    buffer = movecode.newMoveList()
+    legal, checked, counts = array('i'), array('b'), array('b')
+    sources, targets = array('i'), array('i')
+    promotionSources, promotionTargets, promotionTargetIndexes = array('i'), array('b'), array('i')
+    for weakKing in range(64):
+        if weakKing == strongKing or kingAttacks[strongKing] >> weakKing & 1:
+            continue
+        for sq in range(64):
+            if sq == strongKing or sq == weakKing or (pawn and not 8 <= sq < 56):
+                continue
+            for occupied in placed:
+                gs.removePiece(occupied)
+            placed = (strongKing, weakKing, sq)
+            gs.putPiece('wk', strongKing)
+            gs.putPiece('bk', weakKing)
+            gs.putPiece(piece, sq)
+            for weakToMove in (0, 1):
+                gs.whiteMove = not weakToMove
+                if not weakToMove and gs.attackersTo(weakKing, 'w', gs.occupancy):
+                    continue  # the side that just moved can't be in check
+                i = index(weakToMove, strongKing, weakKing, sq)
+                n = gs.generateMoves(buffer)
+                legal.append(i)
+                checked.append(gs.inCheck)
+                counts.append(n)
+                for code in buffer[:n]:
+                    start, end = code & 63, code >> 6 & 63
+                    if weakToMove:
+                        if end != sq:  # taking the piece leaves bare kings, a draw that needs no entry
+                            sources.append(i)
+                            targets.append(index(0, strongKing, end, sq))
+                    elif code & KIND_MASK == PROMOTION:
+                        promoted = code >> 12 & 3
+                        if promoted in promotionTables:  # knight and bishop promotions are draws
+                            promotionSources.append(i)
+                            promotionTargets.append(promotionTables[promoted])
+                            promotionTargetIndexes.append(index(1, strongKing, weakKing, end))
+                    else:
+                        sources.append(i)
+                        targets.append(index(1, end if start == strongKing else strongKing, weakKing,
+                                             sq if start == strongKing else end))
+    return legal, checked, counts, sources, targets, promotionSources, promotionTargets, promotionTargetIndexes
+
+
+def solve(parts, solved):
+    # retrograde analysis over the moves from tableMoves, returns (values, plies to mate) as uint8 arrays of SIZE
+    import numpy as np
+    types = (np.int32, np.int8, np.int8, np.int32, np.int32, np.int32, np.int8, np.int32)
+    legal, checked, counts, sources, targets, promotionSources, promotionTargets, promotionTargetIndexes = [
+        np.concatenate([np.frombuffer(part[k], dtype) for part in parts]) for k, dtype in enumerate(types)]
+    values = np.zeros(SIZE, np.uint8)
+    values[legal] = DRAW
+    distances = np.zeros(SIZE, np.uint8)
+    remaining = np.zeros(SIZE, np.int64)  # moves of each black-to-move position not yet known to lose for black
+    remaining[legal] = counts
+
+    # a promotion into a lost position of the queen or rook table wins a ply later than that position is mated
+    never = np.iinfo(np.int64).max
+    promotionWins = np.full(SIZE, never, np.int64)
+    for t, name in enumerate(order):
+        selected = promotionTargets == t
+        if selected.any():
+            otherValues, otherDistances = solved[name]
+            found = promotionTargetIndexes[selected]
+            lost = otherValues[found] == LOSS
+            plies = otherDistances[found][lost].astype(np.int64) + 1
+            np.minimum.at(promotionWins, promotionSources[selected][lost], plies)
+    lastPromotion = int(promotionWins[promotionWins != never].max(initial=0))
+
+    # mates: black to move, in check, no moves (white can't be checked by a bare king)
+    found = np.zeros(SIZE, bool)
+    found[legal[(counts == 0) & (checked != 0)]] = True
+    values[found] = LOSS
+    ply = 0
+    while found.any() or ply < lastPromotion:
+        ply += 1
+        parents = sources[found[targets]]
+        found = np.zeros(SIZE, bool)
+        found[parents] = True
+        if ply & 1:
+            # white to move wins in ply plies by moving into a loss found last ply
+            found |= promotionWins == ply
+            found &= values == DRAW
+            values[found] = WIN
+        else:
+            # black to move loses once its last move into an undecided position is gone
+            remaining -= np.bincount(parents, minlength=SIZE)
+            found &= (remaining == 0) & (values == DRAW)
+            values[found] = LOSS
+        if ply > 255:
+            raise ValueError("distance to mate doesn't fit in a byte")
+        distances[found] = ply
+    return values, distances
+
+
+def packValues(values):
+    quads = values.reshape(-1, 4)
+    return (quads[:, 0] | quads[:, 1] << 2 | quads[:, 2] << 4 | quads[:, 3] << 6).astype('uint8')
+
+
+def writeFile(path, data):
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def build(names=order, directory=defaultDirectory, workers=None, distances=True, log=None):
+    # solves the named tables (and the tables KPK promotes into) and writes them to directory. Returns
+    # {name: {'win', 'draw', 'loss', 'longest', 'seconds'}} counted over the legal positions with white to move
+    import numpy as np
+    os.makedirs(directory, exist_ok=True)
+    needed = set(names) | ({'KQK', 'KRK'} if 'KPK' in names else set())
+    solved, stats = {}, {}
+    with ProcessPoolExecutor(workers) as pool:
+        for name in order:
+            if name not in needed:
+                continue
+            start = time.perf_counter()
+            parts = list(pool.map(tableMoves, [(name, strongKing) for strongKing in range(64)]))
+            values, plies = solved[name] = solve(parts, solved)
+            writeFile(os.path.join(directory, name + '.wdl'), packValues(values).tobytes())
+            if distances:
+                writeFile(os.path.join(directory, name + '.dtm'), plies.tobytes())
+            whiteToMove = values[:HALF]
+            stats[name] = {'win': int(np.count_nonzero(whiteToMove == WIN)),
+                           'draw': int(np.count_nonzero(whiteToMove == DRAW)),
+                           'loss': int(np.count_nonzero(whiteToMove == LOSS)),
+                           'longest': int(plies.max()), 'seconds': round(time.perf_counter() - start, 2)}
+            if log is not None:
+                log(name, stats[name])
+    return stats
+
+
+class Bitbase:
+    # one table, memory-mapped
+    def __init__(self, path):
+        self.files, self.wdl, self.dtm = [], None, None
+        self.wdl = self.mapFile(path + '.wdl', SIZE // 4)
+        if os.path.isfile(path + '.dtm'):
+            self.dtm = self.mapFile(path + '.dtm', SIZE)
+
+    def mapFile(self, path, size):
+        f = open(path, 'rb')
+        self.files.append(f)
+        actual = os.fstat(f.fileno()).st_size
+        if actual != size:
+            self.close()
+            raise ValueError("%s is not a bitbase (%d bytes, expected %d)" % (path, actual, size))
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.files.append(data)
+        return data
+
+    def value(self, i):
+        return self.wdl[i >> 2] >> ((i & 3) << 1) & 3
+
+    def distance(self, i):
+        return self.dtm[i] if self.dtm is not None else None
+
+    def close(self):
+        for f in reversed(self.files):
+            f.close()
+        self.files = []
+
+
+class Bitbases:
+    # the tables found in a directory. Probes return (wdl, plies) for the side to move: wdl 1 win, 0 draw, -1 loss,
+    # plies to mate (0 for draws, None without a .dtm file), or None when the position isn't covered
+    def __init__(self, directory=defaultDirectory):
+        self.tables = {}
+        for name in order:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path + '.wdl'):
+                self.tables[name] = Bitbase(path)
+
+    def probeRows(self, rows, whiteMove):
+        found = positionIndex(rows, whiteMove)
+        if found is None:
+            return None
+        name, i = found
+        if name == 'draw':
+            return 0, 0
+        table = self.tables.get(name)
+        if table is None:
+            return None
+        value = table.value(i)
+        if value == ILLEGAL:
+            return None
+        return wdlOf[value], table.distance(i) if value != DRAW else 0
+
+    def probe(self, gs):
+        if gs.pieceCount > MAX_PIECES or gs.currentCastleRights.mask():
+            return None
+        return self.probeRows(gs.boardRows(), gs.whiteMove)
+
+    def probeFEN(self, fen):
+        fields = fen.split()
+        if sum(ch.isalpha() for ch in fields[0]) > MAX_PIECES or (len(fields) > 2 and fields[2] != '-'):
+            return None
+        return self.probeRows(engine.parseBoard(fields[0]), len(fields) < 2 or fields[1] == 'w')
+
+    def bestMove(self, gs):
+        # the move that mates fastest, holds the draw or loses slowest, None when the position isn't covered
+        if self.probe(gs) is None:
+            return None
+        best, bestRank = None, None
+        for move in gs.getValid():
+            gs.makeMove(move)
+            result = self.probe(gs)
+            gs.undoMove()
+            if result is None:
+                return None
+            wdl, plies = result  # for the opponent
+            plies = plies or 0
+            rank = (wdl, plies if wdl < 0 else -plies)
+            if bestRank is None or rank < bestRank:
+                best, bestRank = move, rank
+        return best
+
+    def analysis(self, fen):
+        # a result shaped like StockfishPool's ({'fen', 'bestmove', 'centipawns', 'mate'}, white's point of view)
+        result = self.probeFEN(fen)
+        if result is None:
+            return None
+        wdl, plies = result
+        move = self.bestMove(BitboardGameState(fen))
+        sign = 1 if fen.split()[1] == 'w' else -1
+        found = {'fen': fen, 'bestmove': move.getNotation() if move is not None else None, 'bitbase': True,
+                 'centipawns': None, 'mate': None}
+        if wdl == 0:
+            found['centipawns'] = 0
+        elif plies is None:
+            found['centipawns'] = sign * wdl * BITBASE_CENTIPAWNS
+        else:
+            # mate in moves, like the engine: the winner's moves to mate or the loser's moves until mated
+            found['mate'] = sign * ((plies + 1) // 2 if wdl > 0 else -(plies // 2))
+        return found
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        self.tables = {}
+
+
+_defaultBitbases = None
+
+
+def defaultBitbases():
+    # the tables in CHESS_BITBASES, or bitbases/ next to this module, None when there are none
+    global _defaultBitbases
+    if _defaultBitbases is None:
+        bases = Bitbases(os.environ.get('CHESS_BITBASES', defaultDirectory))
+        if not bases.tables:
+            return None
+        _defaultBitbases = bases
+    return _defaultBitbases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and probe KQK, KRK and KPK bitbases")
+    parser.add_argument('--dir', default=os.environ.get('CHESS_BITBASES', defaultDirectory),
+                        help="bitbase directory (default: bitbases/ next to this module)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    buildParser = commands.add_parser('build', help="solve tables by retrograde analysis")
+    buildParser.add_argument('tables', nargs='*', metavar='TABLE', help="any of %s (default: all)" % ', '.join(order))
+    buildParser.add_argument('--workers', type=int, help="worker processes (default: one per core)")
+    buildParser.add_argument('--no-dtm', action='store_true', help="win/draw/loss only, no distance-to-mate file")
+    probeParser = commands.add_parser('probe', help="look a position up")
+    probeParser.add_argument('fen')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        unknown = set(args.tables) - set(order)
+        if unknown:
+            parser.error("unknown tables: %s" % ', '.join(sorted(unknown)))
+
+        def log(name, stats):
+            print("%s: %d won, %d drawn with white to move, longest mate %d plies, %.1fs" % (
+                name, stats['win'], stats['draw'], stats['longest'], stats['seconds']))
+        build(args.tables or order, args.dir, args.workers, not args.no_dtm, log)
+        return
+    bases = Bitbases(args.dir)
+    result = bases.analysis(args.fen)
+    if result is None:
+        print("not in the bitbases in %s" % args.dir, file=sys.stderr)
+        sys.exit(1)
+    wdl, plies = bases.probeFEN(args.fen)
+    print("%s for the side to move%s, best move %s" % (
+        {1: 'win', 0: 'draw', -1: 'loss'}[wdl], " in %d plies" % plies if wdl and plies is not None else '',
+        result['bestmove'] or '-'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import movecode
+import zobrist
+from engine import GameState, START_FEN
+from movecode import KIND_MASK, PROMOTION, EN_PASSANT, CASTLING
+from tables import (bitsOf, slidingAttacks, knightAttacks, kingAttacks, pawnAttacks, between, line,
+                    rookDirections, bishopDirections, queenDirections)
+
+# Bitboard backend for GameState.
+# Squares are numbered row*8 + col, so bit 0 is a8 and bit 63 is h1 - the same orientation as GameState.board,
+# which means (row, col) coordinates, Moves objects and main.py all work unchanged.
+
+pieceNames = ['wp', 'wn', 'wb', 'wr', 'wq', 'wk', 'bp', 'bn', 'bb', 'br', 'bq', 'bk']
+
+# castling rights lost when a move starts or ends on one of these squares (king and rook home squares)
+castleSquares = {60: ('wks', 'wqs'), 63: ('wks',), 56: ('wqs',), 4: ('bks', 'bqs'), 7: ('bks',), 0: ('bqs',)}
+
+
+def squareOf(bit):
+    return bit.bit_length() - 1
+
+
+class BitboardGameState(GameState):
+    # Same makeMove/undoMove/getValid API as GameState, but the position lives in twelve 64-bit piece sets plus
+    # occupancy masks. A plain 8x8 list (mailbox) is kept alongside so Moves can read pieceMoved/pieceCaptured.
+    # Internally moves are packed integers (movecode.py): generateMoves fills a preallocated array and makeMove accepts
+    # either a code or a Moves object. The codes live on the undo stack; self.moves always holds Moves, like GameState.
+    def __init__(self, fen=START_FEN):
+        GameState.__init__(self, fen)
+        self.moveBuffer = movecode.newMoveList()  # scratch list for getValid
+
+    # compatibility view for main.py (drawPieces, highlightSquares) - a fresh '<U2' array every time it's read
+    @property
+    def board(self):
+        import numpy as np
+        return np.array(self.mailbox, dtype='<U2')
+
+    @board.setter
+    def board(self, board):
+        self.mailbox = [['--'] * 8 for _ in range(8)]
+        self.pieces = dict.fromkeys(pieceNames, 0)
+        self.occupied = {'w': 0, 'b': 0}
+        self.occupancy = 0
+        self.zobristHash = 0
+        for r in range(8):
+            for c in range(8):
+                piece = str(board[r][c])
+                if piece != '--':
+                    self.putPiece(piece, r * 8 + c)
+                    if piece == 'wk':
+                        self.whiteKingPos = (r, c)
+                    elif piece == 'bk':
+                        self.blackKingPos = (r, c)
+
+    def newBoard(self, rows):
+        return rows
+
+    def boardRows(self):
+        # the mailbox itself, callers only read it
+        return self.mailbox
+
+    def putPiece(self, piece, sq):
+        bit = 1 << sq
+        self.pieces[piece] |= bit
+        self.occupied[piece[0]] |= bit
+        self.occupancy |= bit
+        self.mailbox[sq >> 3][sq & 7] = piece
+        self.zobristHash ^= zobrist.pieceKeys[piece][sq]
+
+    def removePiece(self, sq):
+        piece = self.mailbox[sq >> 3][sq & 7]
+        if piece != '--':
+            bit = 1 << sq
+            self.pieces[piece] ^= bit
+            self.occupied[piece[0]] ^= bit
+            self.occupancy ^= bit
+            self.mailbox[sq >> 3][sq & 7] = '--'
+            self.zobristHash ^= zobrist.pieceKeys[piece][sq]
+        return piece
+
+    def makeMove(self, move):
+        if isinstance(move, int):
+            code = move
+            move = movecode.toMoves(code, self.mailbox)  # read pieceMoved/pieceCaptured before the board changes
+        else:
+            code = movecode.fromMoves(move)
+        start, end, kind = code & 63, code >> 6 & 63, code & KIND_MASK
+        rights = self.currentCastleRights
+
+        # en passant takes the pawn that sits beside the capturing pawn, everything else captures on the end square
+        captureSq = (start & ~7) | (end & 7) if kind == EN_PASSANT else end
+        self.saveUndo(self.mailbox[captureSq >> 3][captureSq & 7], code)
+        self.zobristHash ^= zobrist.enPassantHash(self.mailbox, self.possibleEnPassant, self.whiteMove)
+        captured = self.removePiece(captureSq)
+        piece = self.removePiece(start)
+        if kind == PROMOTION:
+            self.putPiece(piece[0] + movecode.promotionPiece(code), end)
+        else:
+            self.putPiece(piece, end)
+
+        if kind == CASTLING:
+            if end & 7 == 6:
+                self.putPiece(self.removePiece(end + 1), end - 1)
+            else:
+                self.putPiece(self.removePiece(end - 2), end + 1)
+
+        if piece == 'wk':
+            self.whiteKingPos = (end >> 3, end & 7)
+        elif piece == 'bk':
+            self.blackKingPos = (end >> 3, end & 7)
+
+        if piece[1] == 'p' and abs(start - end) == 16:
+            self.possibleEnPassant = ((start + end) >> 4, end & 7)
+        else:
+            self.possibleEnPassant = ()
+
+        # moving from or capturing on a king/rook home square loses the matching castling rights
+        lost = castleSquares.get(start, ()) + castleSquares.get(end, ())
+        if lost:
+            self.zobristHash ^= zobrist.castleHash(rights)
+            for right in lost:
+                setattr(rights, right, False)
+            self.zobristHash ^= zobrist.castleHash(rights)
+
+        if piece[1] == 'p' or captured != '--':
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if piece[0] == 'b':
+            self.fullmoveNumber += 1
+
+        self.moves.append(move)
+        self.whiteMove = not self.whiteMove
+        self.zobristHash ^= zobrist.blackToMoveKey
+        if self.possibleEnPassant:
+            self.zobristHash ^= zobrist.enPassantHash(self.mailbox, self.possibleEnPassant, self.whiteMove)
+
+    def undoMove(self):
+        if len(self.moves) != 0:
+            self.moves.pop()
+            record = self.undoStack[len(self.moves)]
+            code = record.code
+            captured = record.captured
+            start, end, kind = code & 63, code >> 6 & 63, code & KIND_MASK
+            self.whiteMove = not self.whiteMove
+
+            if kind == CASTLING:
+                if end & 7 == 6:
+                    self.putPiece(self.removePiece(end - 1), end + 1)
+                else:
+                    self.putPiece(self.removePiece(end + 1), end - 2)
+
+            piece = self.removePiece(end)
+            if kind == PROMOTION:
+                piece = piece[0] + 'p'
+            self.putPiece(piece, start)
+            if kind == EN_PASSANT:
+                self.putPiece(captured, (start & ~7) | (end & 7))
+            elif captured != '--':
+                self.putPiece(captured, end)
+
+            if piece == 'wk':
+                self.whiteKingPos = (start >> 3, start & 7)
+            elif piece == 'bk':
+                self.blackKingPos = (start >> 3, start & 7)
+
+            if piece[0] == 'b':
+                self.fullmoveNumber -= 1
+            # putPiece/removePiece changed the hash along the way, the saved one replaces it
+            self.restoreUndo()
+
+    def attackersTo(self, sq, color, occupancy):
+        # every piece of `color` attacking sq, sliders are blocked by `occupancy`
+        pieces = self.pieces
+        other = 'b' if color == 'w' else 'w'
+        attackers = pawnAttacks[other][sq] & pieces[color + 'p']
+        attackers |= knightAttacks[sq] & pieces[color + 'n']
+        attackers |= kingAttacks[sq] & pieces[color + 'k']
+        queens = pieces[color + 'q']
+        diagonal = pieces[color + 'b'] | queens
+        if diagonal:
+            attackers |= slidingAttacks(sq, occupancy, bishopDirections) & diagonal
+        straight = pieces[color + 'r'] | queens
+        if straight:
+            attackers |= slidingAttacks(sq, occupancy, rookDirections) & straight
+        return attackers
+
+    def squareUnderAttack(self, r, c, allyColor):
+        enemyColor = 'b' if allyColor == 'w' else 'w'
+        return self.attackersTo(r * 8 + c, enemyColor, self.occupancy) != 0
+
+    def computeValid(self):
+        # Moves objects for callers of the GameState API, getValid adds the move cache on top
+        buffer = self.moveBuffer
+        return [movecode.toMoves(buffer[i], self.mailbox) for i in range(self.generateMoves(buffer))]
+
+    def generateMoves(self, buffer):
+        # writes every legal move as a packed code into buffer (see movecode.newMoveList), returns how many
+        n = 0
+        allyColor = 'w' if self.whiteMove else 'b'
+        enemyColor = 'b' if self.whiteMove else 'w'
+        pieces = self.pieces
+        own = self.occupied[allyColor]
+        occupancy = self.occupancy
+        kingSq = squareOf(pieces[allyColor + 'k'])
+
+        checkers = self.attackersTo(kingSq, enemyColor, occupancy)
+        self.inCheck = checkers != 0
+
+        # king moves are tested with the king lifted off the board so it can't hide behind itself on a ray
+        withoutKing = occupancy ^ (1 << kingSq)
+        for sq in bitsOf(kingAttacks[kingSq] & ~own):
+            if not self.attackersTo(sq, enemyColor, withoutKing):
+                buffer[n] = kingSq | sq << 6
+                n += 1
+        if checkers & (checkers - 1):  # double check -> only king moves allowed
+            return n
+
+        # a single check can only be answered by capturing the checker or blocking the ray
+        if checkers:
+            targetMask = checkers | between[kingSq][squareOf(checkers)]
+        else:
+            targetMask = ~0
+        targetMask &= ~own
+
+        # pinned pieces may only move along the line through the king and the pinner
+        pinLines = {}
+        enemyQueens = pieces[enemyColor + 'q']
+        snipers = slidingAttacks(kingSq, 0, rookDirections) & (pieces[enemyColor + 'r'] | enemyQueens)
+        snipers |= slidingAttacks(kingSq, 0, bishopDirections) & (pieces[enemyColor + 'b'] | enemyQueens)
+        for sniper in bitsOf(snipers):
+            blockers = between[kingSq][sniper] & occupancy
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pinLines[squareOf(blockers)] = line[kingSq][sniper]
+
+        n = self.generatePawnMoves(allyColor, enemyColor, kingSq, targetMask, pinLines, buffer, n)
+        for sq in bitsOf(pieces[allyColor + 'n']):
+            if sq not in pinLines:
+                for target in bitsOf(knightAttacks[sq] & targetMask):
+                    buffer[n] = sq | target << 6
+                    n += 1
+        for piece, dirs in (('b', bishopDirections), ('r', rookDirections), ('q', queenDirections)):
+            for sq in bitsOf(pieces[allyColor + piece]):
+                targets = slidingAttacks(sq, occupancy, dirs) & targetMask
+                if sq in pinLines:
+                    targets &= pinLines[sq]
+                for target in bitsOf(targets):
+                    buffer[n] = sq | target << 6
+                    n += 1
+
+        if not checkers:
+            n = self.generateCastleMoves(allyColor, kingSq, buffer, n)
+        return n
+
+    def generatePawnMoves(self, allyColor, enemyColor, kingSq, targetMask, pinLines, buffer, n):
+        if allyColor == 'w':
+            forward, startRow, backRow = -8, 6, 0
+        else:
+            forward, startRow, backRow = 8, 1, 7
+        occupancy = self.occupancy
+        enemies = self.occupied[enemyColor]
+        epSq = -1
+        if self.possibleEnPassant:
+            epSq = self.possibleEnPassant[0] * 8 + self.possibleEnPassant[1]
+        for sq in bitsOf(self.pieces[allyColor + 'p']):
+            allowed = targetMask & pinLines.get(sq, ~0)
+            pushes = 0
+            oneStep = sq + forward
+            if not (occupancy >> oneStep) & 1:
+                pushes |= 1 << oneStep
+                if sq >> 3 == startRow and not (occupancy >> (oneStep + forward)) & 1:
+                    pushes |= 1 << (oneStep + forward)
+            attacks = pawnAttacks[allyColor][sq]
+            for target in bitsOf((pushes | (attacks & enemies)) & allowed):
+                if target >> 3 == backRow:
+                    # one move per promotion piece, n/b/r/q
+                    for piece in range(4):
+                        buffer[n] = sq | target << 6 | PROMOTION | piece << 12
+                        n += 1
+                else:
+                    buffer[n] = sq | target << 6
+                    n += 1
+            if epSq >= 0 and (attacks >> epSq) & 1:
+                # en passant removes two pieces from one rank, so test it by playing it on the occupancy mask
+                capturedBit = 1 << (epSq - forward)
+                after = occupancy ^ (1 << sq) ^ capturedBit | (1 << epSq)
+                if not self.attackersTo(kingSq, enemyColor, after) & ~capturedBit:
+                    buffer[n] = sq | epSq << 6 | EN_PASSANT
+                    n += 1
+        return n
+
+    def generateCastleMoves(self, allyColor, kingSq, buffer, n):
+        # only from the king's home square, the rook has to be on its corner as well
+        homeRow = 7 if allyColor == 'w' else 0
+        if kingSq != homeRow * 8 + 4:
+            return n
+        rights = self.currentCastleRights
+        row = self.mailbox[homeRow]
+        attacked = self.squareUnderAttack
+        if (rights.wks if allyColor == 'w' else rights.bks):
+            if row[5] == '--' and row[6] == '--' and row[7] == allyColor + 'r':
+                if not attacked(homeRow, 5, allyColor) and not attacked(homeRow, 6, allyColor):
+                    buffer[n] = kingSq | (kingSq + 2) << 6 | CASTLING
+                    n += 1
+        if (rights.wqs if allyColor == 'w' else rights.bqs):
+            if row[3] == '--' and row[2] == '--' and row[1] == '--' and row[0] == allyColor + 'r':
+                if not attacked(homeRow, 3, allyColor) and not attacked(homeRow, 2, allyColor):
+                    buffer[n] = kingSq | (kingSq - 2) << 6 | CASTLING
+                    n += 1
+        return n
@@ -1,61 +1,195 @@
-import numpy as np
+import tables
+import zobrist
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+fenPieces = {'P': 'wp', 'N': 'wn', 'B': 'wb', 'R': 'wr', 'Q': 'wq', 'K': 'wk',
+             'p': 'bp', 'n': 'bn', 'b': 'bb', 'r': 'br', 'q': 'bq', 'k': 'bk'}
+pieceLetters = {v: k for k, v in fenPieces.items()}
+moveCache = None  # set by movecache.enable(), getValid then looks positions up by Zobrist hash before generating
+
+
+def parseBoard(placement):
+    # FEN piece placement -> 8x8 list of lists, row 0 is rank 8
+    rows = []
+    for rank in placement.split('/'):
+        row = []
+        for ch in rank:
+            if ch.isdigit():
+                row.extend(['--'] * int(ch))
+            else:
+                row.append(fenPieces[ch])
+        if len(row) != 8:
+            raise ValueError("bad FEN rank: " + rank)
+        rows.append(row)
+    if len(rows) != 8:
+        raise ValueError("bad FEN placement: " + placement)
+    return rows
+
 
 #GameState represents the state of the board at any instant of time and
 class GameState:
-    def __init__(self):
-        self.board = np.full((8, 8), '--', dtype='<U2')
-        white_pieces = ['wr', 'wn', 'wb', 'wq', 'wk', 'wb', 'wn', 'wr']
-        black_pieces = ['br', 'bn', 'bb', 'bq', 'bk', 'bb', 'bn', 'br']
-        for i in range(8):
-            self.board[1][i] = 'bp'
-            self.board[6][i] = 'wp'
+    def __init__(self, fen=START_FEN):
+        fields = fen.split()
+        rows = parseBoard(fields[0])
         self.moveFunctions = {
             'p': self.PawnMoves, 'r': self.RookMoves, 'n': self.KnightMoves,
             'b': self.BishopMoves, 'q': self.QueenMoves, 'k': self.KingMoves
         }
-        self.board[7] = white_pieces
-        self.board[0] = black_pieces
+        # assigned in one go so other backends (bitboard.py) can load the position through a board setter
+        self.board = self.newBoard(rows)
         self.pins = []
-        self.whiteKingPos = (7, 4)
-        self.blackKingPos = (0, 4)
+        self.whiteKingPos = self.blackKingPos = None
+        for r in range(8):
+            for c in range(8):
+                if rows[r][c] == 'wk':
+                    self.whiteKingPos = (r, c)
+                elif rows[r][c] == 'bk':
+                    self.blackKingPos = (r, c)
+        # pieces on the board, kings included; only captures change it, so saveUndo/restoreUndo keep it current
+        self.pieceCount = sum(piece != '--' for row in rows for piece in row)
         self.checkMate=False
         self.staleMate=False
+        self.drawReason = None  # set by CheckForMate for repetition, fifty-move and insufficient material draws
         self.checks = []
         self.inCheck = False
-        self.whiteMove = True
+        self.enemyAttacks = set()  # squares the opponent attacks, rebuilt once per getValid
+        self.whiteMove = len(fields) < 2 or fields[1] == 'w'
         self.moves = []
-        self.possibleEnPassant = ()  # coordinates for square where there can be an en passant (row,col)
+        # coordinates for square where there can be an en passant (row,col)
+        epSquare = fields[3] if len(fields) > 3 else '-'
+        self.possibleEnPassant = ()
+        if epSquare != '-':
+            self.possibleEnPassant = (Moves.ranksToRows[epSquare[1]], Moves.filesToCols[epSquare[0]])
+        # halfmoves since the last capture or pawn move, and the move number that goes up after black moves
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        self.fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
 
         # castling
-        self.currentCastleRights = CastleRights(True, True, True, True)
-        # CastleRightsLog stores snapshots of CastleRights BEFORE each move so undo can restore
-        self.CastleRightsLog = [CastleRights(
-            self.currentCastleRights.wks, self.currentCastleRights.wqs,
-            self.currentCastleRights.bks, self.currentCastleRights.bqs
-        )]
+        castling = fields[2] if len(fields) > 2 else '-'
+        self.currentCastleRights = CastleRights('K' in castling, 'Q' in castling, 'k' in castling, 'q' in castling)
+
+        # Zobrist hash of the current position, kept up to date by makeMove/undoMove
+        self.zobristHash = zobrist.hashPosition(self)
+        # undoStack[i] holds what undoMove needs to take back move i (castling rights, en passant square, halfmove
+        # clock and hash from before it). Records are reused: the stack only grows to the deepest ply reached and
+        # entries from len(self.moves) on are spare.
+        self.undoStack = []
+
+    @classmethod
+    def from_fen(cls, fen):
+        return cls(fen)
+
+    def newBoard(self, rows):
+        # numpy is only imported once a NumPy-backed position is made, so importing the engine stays cheap
+        import numpy as np
+        return np.array(rows, dtype='<U2')
+
+    def boardRows(self):
+        # the board as nested lists for code that reads every square, cheaper than indexing the array
+        return self.board.tolist()
 
     #Checks if the Check is a Checkmate/Stalemate, needed to win/draw a game
     def CheckForMate(self):
         moves = self.getValid()
+        # cleared first, so checking again after undoMove doesn't keep reporting a mate that's gone
+        self.checkMate = self.staleMate = False
+        self.drawReason = None
         if len(moves)==0:
             if self.inCheck:
                 self.checkMate=True
             else:
                 self.staleMate=True
+        elif self.isRepetition():
+            self.drawReason = 'threefold repetition'
+        elif self.isFiftyMoveDraw():
+            self.drawReason = 'fifty-move rule'
+        elif self.isInsufficientMaterial():
+            self.drawReason = 'insufficient material'
+
+    def isRepetition(self, count=3):
+        # True if the current position has now occurred `count` times. Only positions since the last capture or
+        # pawn move can match and only every other one has the same side to move, so this looks at halfmoveClock/2
+        # hashes at most.
+        seen = 1
+        ply = len(self.moves)
+        stack = self.undoStack
+        for i in range(2, min(self.halfmoveClock, ply) + 1, 2):
+            if stack[ply - i].hash == self.zobristHash:
+                seen += 1
+                if seen >= count:
+                    return True
+        return False
+
+    def isFiftyMoveDraw(self):
+        return self.halfmoveClock >= 100
+
+    def isInsufficientMaterial(self):
+        # neither side can mate: bare kings, a single knight or bishop, or only bishops that all stand on one colour
+        minors = []
+        for r, row in enumerate(self.boardRows()):
+            for c, piece in enumerate(row):
+                if piece[1] in 'pqr':
+                    return False
+                if piece[1] in 'nb':
+                    minors.append((piece[1], (r + c) % 2))
+        if len(minors) <= 1:
+            return True
+        return all(kind == 'b' for kind, _ in minors) and len(set(colour for _, colour in minors)) == 1
+
+    def saveUndo(self, captured, code=0):
+        # fills the undo record for the move about to be made, before makeMove changes anything
+        ply = len(self.moves)
+        stack = self.undoStack
+        if ply < len(stack):
+            record = stack[ply]
+        else:
+            record = UndoRecord()
+            stack.append(record)
+        record.castling = self.currentCastleRights.mask()
+        record.enPassant = self.possibleEnPassant
+        record.halfmoveClock = self.halfmoveClock
+        record.hash = self.zobristHash
+        record.captured = captured
+        record.code = code
+        if captured != '--':
+            self.pieceCount -= 1
+
+    def restoreUndo(self):
+        # puts back the state saved for the move undoMove just popped off self.moves
+        record = self.undoStack[len(self.moves)]
+        self.currentCastleRights.setMask(record.castling)
+        self.possibleEnPassant = record.enPassant
+        self.halfmoveClock = record.halfmoveClock
+        self.zobristHash = record.hash
+        if record.captured != '--':
+            self.pieceCount += 1
+        return record
 
     def makeMove(self, move):
-        # record castle rights snapshot BEFORE updating (for undo)
-        self.CastleRightsLog.append(CastleRights(
-            self.currentCastleRights.wks, self.currentCastleRights.wqs,
-            self.currentCastleRights.bks, self.currentCastleRights.bqs
-        ))
+        self.saveUndo(move.pieceCaptured)
+        keys = zobrist.pieceKeys
+        # the old en passant key comes out while the board still shows who could have taken
+        self.zobristHash ^= zobrist.enPassantHash(self.board, self.possibleEnPassant, self.whiteMove)
+
+        if move.pieceMoved[1] == 'p' or move.pieceCaptured != '--':
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if move.pieceMoved[0] == 'b':
+            self.fullmoveNumber += 1
 
         # move piece
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
+        self.zobristHash ^= keys[move.pieceMoved][move.startRow * 8 + move.startCol]
+        self.zobristHash ^= keys[move.pieceMoved][move.endRow * 8 + move.endCol]
+        if move.pieceCaptured != '--':
+            capturedRow = move.startRow if move.enPassant else move.endRow
+            self.zobristHash ^= keys[move.pieceCaptured][capturedRow * 8 + move.endCol]
         self.moves.append(move)
         # flip turn
         self.whiteMove = not self.whiteMove
+        self.zobristHash ^= zobrist.blackToMoveKey
 
         # update king position
         if move.pieceMoved == "wk":
@@ -66,6 +200,7 @@ class GameState:
         # en passant possible square (store integers)
         if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
             self.possibleEnPassant = ((move.startRow + move.endRow) // 2, move.endCol)
+            self.zobristHash ^= zobrist.enPassantHash(self.board, self.possibleEnPassant, self.whiteMove)
         else:
             self.possibleEnPassant = ()
 
@@ -79,11 +214,10 @@ class GameState:
 
         # pawn promotion
         if move.pawnPromotion:
-            # allow for input  but default to queen if invalid/no input
-            promotedPiece = input("Promote to (q/r/b/n): ").strip().lower()
-            mapping = {'q': 'q', 'r': 'r', 'b': 'b', 'n': 'n'}
-            pieceChar = mapping.get(promotedPiece, 'q')
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + pieceChar
+            promotedPiece = move.pieceMoved[0] + move.promotionPiece
+            self.board[move.endRow][move.endCol] = promotedPiece
+            self.zobristHash ^= keys[move.pieceMoved][move.endRow * 8 + move.endCol]
+            self.zobristHash ^= keys[promotedPiece][move.endRow * 8 + move.endCol]
 
         # update castling rights because rook/king moved or rook captured
         self.updateCastleRights(move)
@@ -95,10 +229,14 @@ class GameState:
                 # rook moves from (endRow, 7) to (endRow, endCol - 1)
                 self.board[move.endRow][move.endCol - 1] = self.board[move.endRow][7]
                 self.board[move.endRow][7] = "--"
+                rookStart, rookEnd = move.endRow * 8 + 7, move.endRow * 8 + move.endCol - 1
             else:
                 # queen-side castle: rook from (endRow, 0) to (endRow, endCol + 1)
                 self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][0]
                 self.board[move.endRow][0] = "--"
+                rookStart, rookEnd = move.endRow * 8, move.endRow * 8 + move.endCol + 1
+            rook = move.pieceMoved[0] + 'r'
+            self.zobristHash ^= keys[rook][rookStart] ^ keys[rook][rookEnd]
 
     def undoMove(self):
         if len(self.moves) != 0:
@@ -124,10 +262,8 @@ class GameState:
                 else:
                     self.board[move.endRow - 1][move.endCol] = 'wp'
                 self.board[move.endRow][move.endCol] = "--"
-                self.possibleEnPassant = (move.endRow, move.endCol)
-            # reset possible en passant if the undone move was the two-square pawn move
-            if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-                self.possibleEnPassant = ()
+            if move.pieceMoved[0] == 'b':
+                self.fullmoveNumber -= 1
 
             # undo castling rook movement
             if move.Castling:
@@ -139,11 +275,11 @@ class GameState:
                     self.board[move.endRow][0] = self.board[move.endRow][move.endCol + 1]
                     self.board[move.endRow][move.endCol + 1] = "--"
 
-            # restore castling rights from log (last snapshot is the state BEFORE the undone move)
-            lastRights = self.CastleRightsLog.pop()
-            self.currentCastleRights = CastleRights(lastRights.wks, lastRights.wqs, lastRights.bks, lastRights.bqs)
+            # castling rights, en passant square, halfmove clock and hash as they were before the move
+            self.restoreUndo()
 
     def updateCastleRights(self, move):
+        self.zobristHash ^= zobrist.castleHash(self.currentCastleRights)
         # if king moves, lose both castling rights for that colour
         if move.pieceMoved == 'wk':
             self.currentCastleRights.wks = False
@@ -173,38 +309,37 @@ class GameState:
                 self.currentCastleRights.bqs = False
             elif move.endRow == 0 and move.endCol == 7:
                 self.currentCastleRights.bks = False
+        self.zobristHash ^= zobrist.castleHash(self.currentCastleRights)
 
     def getValid(self):
+        if moveCache is None:
+            return self.computeValid()
+        validmoves = moveCache.lookup(self)
+        if validmoves is None:
+            validmoves = self.computeValid()
+            moveCache.store(self, validmoves)
+        return validmoves
+
+    def computeValid(self):
         validmoves = []
         self.inCheck, self.pins, self.checks = self.checkPinsChecks()
         if self.whiteMove:
             kingRow, kingCol = self.whiteKingPos
         else:
             kingRow, kingCol = self.blackKingPos
+        # one attack map per position covers every king move and castling square
+        self.enemyAttacks = self.getAttackMap("b" if self.whiteMove else "w")
         if self.inCheck:
             if len(self.checks) == 1:  # single check -> block, capture or king move
                 validmoves = self.getAllMoves()
                 check = self.checks[0]
-                checkRow, checkCol = check[0], check[1]
-                pieceChecking = self.board[checkRow][checkCol]
-                validSquares = []
-                if pieceChecking[1] == 'n':
-                    validSquares = [(checkRow, checkCol)]
-                else:
-                    # add squares between king and checking piece (inclusive)
-                    for i in range(1, 8):
-                        endRow = kingRow + check[2] * i
-                        endCol = kingCol + check[3] * i
-                        if 0 <= endRow < 8 and 0 <= endCol < 8:
-                            validSquares.append((endRow, endCol))
-                            print("Valid Square: ", validSquares)
-                            if endRow == checkRow and endCol == checkCol:
-                                break
-                # remove moves that don't block check (except king moves)
-                for i in range(len(validmoves) - 1, -1, -1):
-                    if validmoves[i].pieceMoved[1] != 'k':
-                        if (validmoves[i].endRow, validmoves[i].endCol) not in validSquares:
-                            validmoves.remove(validmoves[i])
+                checkSq = check[0] * 8 + check[1]
+                # capture the checking piece or block between it and the king (nothing between for knights/pawns)
+                validSquares = tables.between[kingRow * 8 + kingCol][checkSq] | (1 << checkSq)
+                # keep only moves that block check (and king moves), one pass instead of list.remove per move.
+                # En passant was already played out against the king in enPassantIsLegal
+                validmoves = [m for m in validmoves
+                              if m.pieceMoved[1] == 'k' or m.enPassant or validSquares >> (m.endRow * 8 + m.endCol) & 1]
             else:
                 # double check -> only king moves allowed
                 self.KingMoves(kingRow, kingCol, validmoves)
@@ -213,6 +348,8 @@ class GameState:
 
         return validmoves
 
+    # Still one Moves object per candidate: packed move codes (movecode.py) are only generated by BitboardGameState,
+    # this generator stays the reference implementation the bitboard one is checked against
     def getAllMoves(self): #All moves that are possible without taking checks & pins into consideration
         allMoves = []
         for i in range(len(self.board)):
@@ -245,37 +382,54 @@ class GameState:
             startRow = 1
             backRow = 7
             enemyColor = 'w'
-        pawnPromotion = False
-
         # Move Logic
+        # a pinned pawn keeps to the line through its king, towards the king as well as away from it
         # One Square Forward
         if 0 <= i + moveAmount < 8 and self.board[i + moveAmount][j] == "--":
-            if not piecePinned or pinDirection == (moveAmount, 0):
-                if i + moveAmount == backRow:
-                    pawnPromotion = True
-                allMoves.append(Moves((i, j), (i + moveAmount, j), self.board, pawnPromotion=pawnPromotion))
+            if not piecePinned or pinDirection in ((moveAmount, 0), (-moveAmount, 0)):
+                self.addPawnMove((i, j), (i + moveAmount, j), backRow, allMoves)
                 # Two Squares from Starting Position
                 if i == startRow and self.board[i + 2 * moveAmount][j] == "--":
                     allMoves.append(Moves((i, j), (i + 2 * moveAmount, j), self.board))
 
         # captures
         if j - 1 >= 0:
-            if not piecePinned or pinDirection == (moveAmount, -1):
+            if not piecePinned or pinDirection in ((moveAmount, -1), (-moveAmount, 1)):
                 if self.board[i + moveAmount][j - 1][0] == enemyColor:
-                    if i + moveAmount == backRow:
-                        pawnPromotion = True
-                    allMoves.append(Moves((i, j), (i + moveAmount, j - 1), self.board, pawnPromotion=pawnPromotion))
-                if (i + moveAmount, j - 1) == self.possibleEnPassant:
+                    self.addPawnMove((i, j), (i + moveAmount, j - 1), backRow, allMoves)
+                if (i + moveAmount, j - 1) == self.possibleEnPassant and self.enPassantIsLegal(i, j, j - 1):
                     allMoves.append(Moves((i, j), (i + moveAmount, j - 1), self.board, enPassant=True))
         if j + 1 <= 7:
-            if not piecePinned or pinDirection == (moveAmount, 1):
+            if not piecePinned or pinDirection in ((moveAmount, 1), (-moveAmount, -1)):
                 if self.board[i + moveAmount][j + 1][0] == enemyColor:
-                    if i + moveAmount == backRow:
-                        pawnPromotion = True
-                    allMoves.append(Moves((i, j), (i + moveAmount, j + 1), self.board, pawnPromotion=pawnPromotion))
-                if (i + moveAmount, j + 1) == self.possibleEnPassant:
+                    self.addPawnMove((i, j), (i + moveAmount, j + 1), backRow, allMoves)
+                if (i + moveAmount, j + 1) == self.possibleEnPassant and self.enPassantIsLegal(i, j, j + 1):
                     allMoves.append(Moves((i, j), (i + moveAmount, j + 1), self.board, enPassant=True))
 
+    def addPawnMove(self, startSq, endSq, backRow, allMoves):
+        # a pawn reaching the back row is four different moves, one per piece it can become
+        if endSq[0] == backRow:
+            for piece in 'qrbn':
+                allMoves.append(Moves(startSq, endSq, self.board, pawnPromotion=True, promotionPiece=piece))
+        else:
+            allMoves.append(Moves(startSq, endSq, self.board))
+
+    def enPassantIsLegal(self, i, j, endCol):
+        # en passant takes two pawns off one rank, which can open a line to our king that the pin scan never saw
+        # (or fail to stop a check), so play it out on the board and look at the king
+        allyColor = self.board[i][j][0]
+        kingRow, kingCol = self.whiteKingPos if allyColor == 'w' else self.blackKingPos
+        endRow = self.possibleEnPassant[0]
+        captured = self.board[i][endCol]
+        self.board[i][j] = "--"
+        self.board[i][endCol] = "--"
+        self.board[endRow][endCol] = allyColor + 'p'
+        legal = not self.squareUnderAttack(kingRow, kingCol, allyColor)
+        self.board[endRow][endCol] = "--"
+        self.board[i][endCol] = captured
+        self.board[i][j] = allyColor + 'p'
+        return legal
+
     def RookMoves(self, i, j, allMoves):
         piecePinned = False
         pinDirection = ()
@@ -286,24 +440,24 @@ class GameState:
                 if self.board[i][j][1] != 'q':  # can't remove queen from pin
                     self.pins.remove(self.pins[k])
                 break
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
+        self.slidingMoves(i, j, tables.rookDirections, piecePinned, pinDirection, allMoves)
+
+    def slidingMoves(self, i, j, directionIndices, piecePinned, pinDirection, allMoves):
+        # walks the precomputed rays (tables.raySquares) for the given tables.directions indices
         enemy = "b" if self.whiteMove else "w"
-        for d in directions:
-            for a in range(1, 8):
-                endRow = i + d[0] * a
-                endCol = j + d[1] * a
-                if 0 <= endRow < 8 and 0 <= endCol < 8:  # on the board
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--":
-                            allMoves.append(Moves((i, j), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemy:
-                            allMoves.append(Moves((i, j), (endRow, endCol), self.board))
-                            break
-                        else:
-                            break
-                else:
-                    break
+        rays = tables.raySquares[i][j]
+        for k in directionIndices:
+            d = tables.directions[k]
+            if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
+                for endRow, endCol in rays[k]:
+                    endPiece = self.board[endRow][endCol]
+                    if endPiece == "--":
+                        allMoves.append(Moves((i, j), (endRow, endCol), self.board))
+                    elif endPiece[0] == enemy:
+                        allMoves.append(Moves((i, j), (endRow, endCol), self.board))
+                        break
+                    else:
+                        break
 
     def KnightMoves(self, i, j, allMoves):
         piecePinned = False
@@ -312,16 +466,13 @@ class GameState:
                 piecePinned = True
                 self.pins.remove(self.pins[k])
                 break
-        directions = ((-1, -2), (-2, -1), (-1, 2), (-2, 1), (1, 2), (2, 1), (1, -2), (2, -1))
+        if piecePinned:
+            return
         enemy = "b" if self.whiteMove else "w"
-        for d in directions:
-            endRow = i + d[0]
-            endCol = j + d[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                if not piecePinned:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == "--" or endPiece[0] == enemy:
-                        allMoves.append(Moves((i, j), (endRow, endCol), self.board))
+        for endRow, endCol in tables.knightSquares[i][j]:
+            endPiece = self.board[endRow][endCol]
+            if endPiece == "--" or endPiece[0] == enemy:
+                allMoves.append(Moves((i, j), (endRow, endCol), self.board))
 
     def BishopMoves(self, i, j, allMoves):
         piecePinned = False
@@ -330,54 +481,22 @@ class GameState:
             if self.pins[k][0] == i and self.pins[k][1] == j:
                 piecePinned = True
                 pinDirection = (self.pins[k][2], self.pins[k][3])
-                self.pins.remove(self.pins[k])
+                if self.board[i][j][1] != 'q':  # RookMoves still needs the queen's pin
+                    self.pins.remove(self.pins[k])
                 break
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
-        enemy = "b" if self.whiteMove else "w"
-        for d in directions:
-            for a in range(1, 8):
-                endRow = i + d[0] * a
-                endCol = j + d[1] * a
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--":
-                            allMoves.append(Moves((i, j), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemy:
-                            allMoves.append(Moves((i, j), (endRow, endCol), self.board))
-                            break
-                        else:
-                            break
-                    else:
-                        break
+        self.slidingMoves(i, j, tables.bishopDirections, piecePinned, pinDirection, allMoves)
 
     def QueenMoves(self, i, j, allMoves):
         self.BishopMoves(i, j, allMoves)
         self.RookMoves(i, j, allMoves)
 
     def KingMoves(self, i, j, allMoves):
-        rowMoves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        colMoves = (-1, 0, 1, -1, 1, -1, 0, 1)
         allyColor = "w" if self.whiteMove else "b"
-        for k in range(8):
-            endRow = i + rowMoves[k]
-            endCol = j + colMoves[k]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:  # not an ally
-                    # place king on end square and check for checks
-                    originalWhiteKing = self.whiteKingPos
-                    originalBlackKing = self.blackKingPos
-                    if allyColor == 'w':
-                        self.whiteKingPos = (endRow, endCol)
-                    else:
-                        self.blackKingPos = (endRow, endCol)
-                    inCheck, pins, checks = self.checkPinsChecks()
-                    if not inCheck:
-                        allMoves.append(Moves((i, j), (endRow, endCol), self.board))
-                    # restore king pos
-                    self.whiteKingPos = originalWhiteKing
-                    self.blackKingPos = originalBlackKing
+        for endRow, endCol in tables.kingSquares[i][j]:
+            endPiece = self.board[endRow][endCol]
+            # not an ally and not a square the enemy attacks (attack map from getValid)
+            if endPiece[0] != allyColor and (endRow, endCol) not in self.enemyAttacks:
+                allMoves.append(Moves((i, j), (endRow, endCol), self.board))
         # add castling moves (efficient checks)
         self.getCastleMoves(i, j, allMoves, allyColor)
 
@@ -395,7 +514,7 @@ class GameState:
     def getKingsideCastleMoves(self, r, c, allMoves, allyColor):
         # squares between king and rook must be empty and not under attack
         if self.board[r][c + 1] == "--" and self.board[r][c + 2] == "--":
-            if not self.squareUnderAttack(r, c + 1, allyColor) and not self.squareUnderAttack(r, c + 2, allyColor):
+            if (r, c + 1) not in self.enemyAttacks and (r, c + 2) not in self.enemyAttacks:
                 # ensure rook is at expected square
                 rook_piece = self.board[r][7]
                 if rook_piece == (allyColor + 'r'):
@@ -406,14 +525,45 @@ class GameState:
     def getQueensideCastleMoves(self, r, c, allMoves, allyColor):
         # squares between king and rook (queenside) must be empty and not under attack
         if self.board[r][c - 1] == "--" and self.board[r][c - 2] == "--" and self.board[r][c - 3] == "--":
-            if not self.squareUnderAttack(r, c - 1, allyColor) and not self.squareUnderAttack(r, c - 2, allyColor):
+            if (r, c - 1) not in self.enemyAttacks and (r, c - 2) not in self.enemyAttacks:
                 rook_piece = self.board[r][0]
                 if rook_piece == (allyColor + 'r'):
                     m = Moves((r, c), (r, c - 2), self.board)
                     m.Castling = True
                     allMoves.append(m)
 
-    def squareUnderAttack(self, r, c, allyColor): #with reference to castling, not used for anything else
+    def getAttackMap(self, enemyColor):
+        # every square enemyColor attacks. Our king is treated as empty so a king stepping back along a checking
+        # ray still counts as attacked.
+        allyKing = ('w' if enemyColor == 'b' else 'b') + 'k'
+        board = self.board.tolist()
+        attacked = set()
+        pawnRow = -1 if enemyColor == 'w' else 1
+        sliderDirections = {'r': tables.rookDirections, 'b': tables.bishopDirections, 'q': tables.queenDirections}
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece[0] != enemyColor:
+                    continue
+                pieceType = piece[1]
+                if pieceType == 'p':
+                    for dc in (-1, 1):
+                        if 0 <= r + pawnRow < 8 and 0 <= c + dc < 8:
+                            attacked.add((r + pawnRow, c + dc))
+                elif pieceType == 'n':
+                    attacked.update(tables.knightSquares[r][c])
+                elif pieceType == 'k':
+                    attacked.update(tables.kingSquares[r][c])
+                else:
+                    rays = tables.raySquares[r][c]
+                    for d in sliderDirections[pieceType]:
+                        for row, col in rays[d]:
+                            attacked.add((row, col))
+                            if board[row][col] != "--" and board[row][col] != allyKing:
+                                break
+        return attacked
+
+    def squareUnderAttack(self, r, c, allyColor): #single square version of getAttackMap
         enemyColor = "b" if allyColor == "w" else "w"
 
         # pawn attacks
@@ -425,20 +575,13 @@ class GameState:
                     return True
 
         # knights
-        knight_dirs = [(-2, -1), (-1, -2), (-2, 1), (-1, 2), (1, -2), (2, -1), (1, 2), (2, 1)]
-        for d in knight_dirs:
-            row, col = r + d[0], c + d[1]
-            if 0 <= row < 8 and 0 <= col < 8:
-                if self.board[row][col] == enemyColor + 'n':
-                    return True
+        for row, col in tables.knightSquares[r][c]:
+            if self.board[row][col] == enemyColor + 'n':
+                return True
 
         # rooks, bishops, queens (sliding)
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
-        for i, d in enumerate(directions):
-            for dist in range(1, 8):
-                row, col = r + d[0] * dist, c + d[1] * dist
-                if not (0 <= row < 8 and 0 <= col < 8):
-                    break
+        for i, ray in enumerate(tables.raySquares[r][c]):
+            for row, col in ray:
                 piece = self.board[row][col]
                 if piece == "--":
                     continue
@@ -454,14 +597,9 @@ class GameState:
                 break
 
         # king (adjacent)
-        for dr in (-1, 0, 1):
-            for dc in (-1, 0, 1):
-                if dr == 0 and dc == 0:
-                    continue
-                row, col = r + dr, c + dc
-                if 0 <= row < 8 and 0 <= col < 8:
-                    if self.board[row][col] == enemyColor + 'k':
-                        return True
+        for row, col in tables.kingSquares[r][c]:
+            if self.board[row][col] == enemyColor + 'k':
+                return True
 
         return False
 
@@ -480,81 +618,71 @@ class GameState:
             startRow = self.blackKingPos[0]
             startCol = self.blackKingPos[1]
 
-        directions = [(-1, 0), (0, -1), (1, 0), (0, 1),
-                      (-1, -1), (-1, 1), (1, -1), (1, 1)]
-        # UP, LEFT, DOWN, RIGHT, UL, UR, DL, DR
-
-        for j in range(len(directions)):
-            d = directions[j]
+        # UP, LEFT, DOWN, RIGHT, UL, UR, DL, DR (tables.directions order)
+        rays = tables.raySquares[startRow][startCol]
+        for j in range(8):
+            d = tables.directions[j]
             possiblePin = ()
-            for i in range(1, 8):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor and endPiece[1] != 'k':
+            for i, (endRow, endCol) in enumerate(rays[j], 1):
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == allyColor and endPiece[1] != 'k':
+                    if possiblePin == ():
+                        possiblePin = (endRow, endCol, d[0], d[1])
+                    else:
+                        break
+                elif endPiece[0] == enemyColor:
+                    type = endPiece[1]
+                    if (0 <= j <= 3 and type == 'r') or \
+                            (4 <= j <= 7 and type == 'b') or \
+                            (i == 1 and type == 'p' and (
+                                    (enemyColor == 'w' and 6 <= j <= 7) or
+                                    (enemyColor == 'b' and 4 <= j <= 5)
+                            )) or \
+                            (type == 'q') or \
+                            (i == 1 and type == 'k'):
                         if possiblePin == ():
-                            possiblePin = (endRow, endCol, d[0], d[1])
-                        else:
+                            inCheck = True
+                            checks.append((endRow, endCol, d[0], d[1]))
                             break
-                    elif endPiece[0] == enemyColor:
-                        type = endPiece[1]
-                        if (0 <= j <= 3 and type == 'r') or \
-                                (4 <= j <= 7 and type == 'b') or \
-                                (i == 1 and type == 'p' and (
-                                        (enemyColor == 'w' and 6 <= j <= 7) or
-                                        (enemyColor == 'b' and 4 <= j <= 5)
-                                )) or \
-                                (type == 'q') or \
-                                (i == 1 and type == 'k'):
-                            if possiblePin == ():
-                                inCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
-                            else:
-                                pins.append(possiblePin)
-                                break
                         else:
+                            pins.append(possiblePin)
                             break
-                else:
-                    break
+                    else:
+                        break
 
-        knightMoves = [(-1, -2), (-2, -1), (-1, 2), (-2, 1),
-                       (1, 2), (2, 1), (1, -2), (2, -1)]
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == "n":
-                    inCheck = True
-                    checks.append((endRow, endCol, m[0], m[1]))
+        for endRow, endCol in tables.knightSquares[startRow][startCol]:
+            endPiece = self.board[endRow][endCol]
+            if endPiece[0] == enemyColor and endPiece[1] == "n":
+                inCheck = True
+                checks.append((endRow, endCol, endRow - startRow, endCol - startCol))
 
         return inCheck, pins, checks
 
     def getFEN(self):
-        fen = ""
-        for row in self.board:
+        ranks = []
+        for row in self.boardRows():
+            rank = ""
             empty = 0
             for square in row:
                 if square == "--":
                     empty += 1
                 else:
                     if empty != 0:
-                        fen += str(empty)
+                        rank += str(empty)
                         empty = 0
-                    piece = square[1]
-                    if square[0] == "w":
-                        piece = piece.upper()
-                    fen += piece
+                    rank += pieceLetters[square]
             if empty != 0:
-                fen += str(empty)
-            fen += "/"
-        fen = fen[:-1]  # remove last '/'
-        fen += " "
-        fen += "w" if self.whiteMove else "b"
-        fen += " KQkq - 0 1"  # basic placeholders (you can expand later)
-        return fen
+                rank += str(empty)
+            ranks.append(rank)
+        rights = self.currentCastleRights
+        castling = ('K' if rights.wks else '') + ('Q' if rights.wqs else '') + \
+            ('k' if rights.bks else '') + ('q' if rights.bqs else '')
+        if self.possibleEnPassant:
+            enPassant = Moves.colsToFiles[self.possibleEnPassant[1]] + Moves.rowsToRanks[self.possibleEnPassant[0]]
+        else:
+            enPassant = "-"
+        return "%s %s %s %s %d %d" % ("/".join(ranks), "w" if self.whiteMove else "b", castling or "-", enPassant,
+                                      self.halfmoveClock, self.fullmoveNumber)
 
 
 class CastleRights:
@@ -563,15 +691,38 @@ class CastleRights:
         self.wqs = wqs
         self.bks = bks
         self.bqs = bqs
+
+    # the four rights packed as wks | wqs << 1 | bks << 2 | bqs << 3, how undo records store them
+    def mask(self):
+        return self.wks | self.wqs << 1 | self.bks << 2 | self.bqs << 3
+
+    def setMask(self, mask):
+        self.wks = mask & 1 != 0
+        self.wqs = mask & 2 != 0
+        self.bks = mask & 4 != 0
+        self.bqs = mask & 8 != 0
+
+
+class UndoRecord:
+    # one per ply on GameState.undoStack: castling rights as a 4-bit mask, en passant square, halfmove clock and
+    # hash from before the move, the captured piece ('--' if none) and the packed move code (bitboard backend)
+    __slots__ = ('castling', 'enPassant', 'halfmoveClock', 'hash', 'captured', 'code')
+
+
 class Moves:
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
+    # no per-instance __dict__, generators create a lot of these
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured',
+                 'enPassant', 'pawnPromotion', 'promotionPiece', 'Castling', 'moveID')
+    promotionPieces = 'nbrq'
 
     #How the board actually makes moves
     #startSq and endSq are two-dimensional arrays representing the starting and ending square of the piece
-    def __init__(self, startSq, endSq, board, enPassant=False, pawnPromotion=False, Castling=False):
+    #promotionPiece is 'q', 'r', 'b' or 'n', every promotion is generated once per piece
+    def __init__(self, startSq, endSq, board, enPassant=False, pawnPromotion=False, Castling=False, promotionPiece='q'):
         self.startRow = startSq[0]
         self.startCol = startSq[1]
         self.endRow = endSq[0]
@@ -580,6 +731,7 @@ class Moves:
         self.pieceCaptured = board[self.endRow][self.endCol]
         self.enPassant = enPassant
         self.pawnPromotion = pawnPromotion
+        self.promotionPiece = promotionPiece if pawnPromotion else None
         self.Castling = Castling
         if enPassant:
             # If enPassant, captured pawn is behind the end square
@@ -587,6 +739,8 @@ class Moves:
 
         #Encoding moves to check equality
         self.moveID=self.startRow*1000+self.startCol*100+self.endRow*10+self.endCol
+        if pawnPromotion:
+            self.moveID += (self.promotionPieces.index(promotionPiece) + 1) * 10000
 
     #Important to check true equality of moves, without it, move objects would literally have to be the same even if they're
     #the same move
@@ -596,7 +750,10 @@ class Moves:
         return False
 
     def getNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.pawnPromotion:
+            notation += self.promotionPiece
+        return notation
 
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
@@ -604,28 +761,14 @@ class Moves:
 
 
 
-def get_best_move_from_stockfish(gs):
-
-    fen = gs.getFEN()
-    stockfish.set_fen_position(fen)
-    best_move = stockfish.get_best_move()
-    return best_move
-
-
-from stockfish import Stockfish
-
-
-stockfish = Stockfish(
-    path="/Users/michaeltunglut/PycharmProjects/chess/stockfish/stockfish",
-    parameters={
-        "Threads": 2,
-        "Skill Level": 10,
-    }
-)
-
-
-
-
-
-
-
+def get_best_move_from_stockfish(gs, depth=None, movetime=None, timeout=None, useBook=True):
+    # opening book first, then blocks until the shared pool answers - UI code should keep the future from
+    # analysis.defaultPool() instead. Imported here so the move generator never pays for the engine service (or
+    # starts a process) on import.
+    import analysis
+    import polyglot
+    if useBook:
+        bookMove = polyglot.bookMove(gs)
+        if bookMove is not None:
+            return bookMove
+    return analysis.defaultPool().analyse(gs.getFEN(), depth, movetime, timeout).result()['bestmove']
@@ -1,16 +1,21 @@
 import pygame as p
 import engine
+import movecache
 
 width=height=512
 dimension=8
 square_size=width//dimension
 max_fps=15
+move_cache_bytes=4<<20 #legal moves of positions already seen, undo and CheckForMate then skip move generation
 images={}
+fonts={}
 
 def loadimages():
     pieces=['wp','wr','wn','wb','wq','wk','bp','br','bn','bb','bq','bk']
     for piece in pieces:
-        images[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (square_size, square_size))
+        #the files are named wp.png, wR.png, bK.png..., which only matters on case-sensitive file systems
+        name=piece[0]+(piece[1] if piece[1]=='p' else piece[1].upper())
+        images[piece] = p.transform.scale(p.image.load("images/" + name + ".png"), (square_size, square_size))
 
 
 def main():
@@ -18,22 +23,32 @@ def main():
     screen=p.display.set_mode((width,height))
     clock=p.time.Clock()
     screen.fill(p.Color("white"))
+    movecache.enable(move_cache_bytes)
     gs=engine.GameState()
     validmoves=gs.getValid()
     for move in validmoves:
         print(move.getNotation())
     moveMade=False
     loadimages()
+    renderer=BoardRenderer(screen)
+    status=gameStatus(gs)
+    needsDraw=True
     running=True
     sqSelected =() #last click of user
     playerclicks=[] #keeps track of all user clicks
     gameOver=False
     aiLastMove=None
     while running:
-        for e in p.event.get():
+        #sleeps until there is an event instead of drawing max_fps frames a second
+        events=[p.event.wait()]+p.event.get()
+        for e in events:
             if e.type==p.QUIT:
                 running=False
+            elif e.type in (p.WINDOWEXPOSED,p.VIDEOEXPOSE):
+                renderer.invalidate()
+                needsDraw=True
             elif e.type==p.MOUSEBUTTONDOWN:
+                needsDraw=True
                 location=p.mouse.get_pos()
                 col=location[0]//square_size
                 row=location[1]//square_size
@@ -46,12 +61,17 @@ def main():
                 if len(playerclicks)==2:
                     move=engine.Moves(playerclicks[0],playerclicks[1],gs.board)
                     print(move.getNotation())
-                    for i in range(len(validmoves)):
-                        if move == validmoves[i]:
-                            gs.makeMove(validmoves[i])
-                            moveMade=True
-                            sqSelected=()
-                            playerclicks=[]
+                    #a promotion matches four valid moves, one per piece, so ask which one the player wants
+                    candidates=[m for m in validmoves if m.moveID%10000==move.moveID]
+                    if len(candidates)>1:
+                        piece=choosePromotion(screen,clock,gs.whiteMove)
+                        candidates=[m for m in candidates if m.promotionPiece==piece]
+                        renderer.invalidate() #the picker was drawn over the board
+                    if candidates:
+                        gs.makeMove(candidates[0])
+                        moveMade=True
+                        sqSelected=()
+                        playerclicks=[]
                     if not moveMade:
                         playerclicks=[sqSelected]
             elif e.type==p.KEYDOWN:
@@ -61,40 +81,136 @@ def main():
                 if e.key==p.K_r:
                     gs=engine.GameState()
                     validmoves=gs.getValid()
+                    status=gameStatus(gs)
                     sqSelected=()
                     playerclicks=[]
                     moveMade=False
+                    needsDraw=True
         if moveMade:
+            #legal moves and mate/draw status are worked out once per position, not every frame
             validmoves=gs.getValid()
+            status=gameStatus(gs)
+            gameOver=status is not None
             moveMade=False
+            needsDraw=True
 
             # if not gs.whiteMove:  # assuming white = player, black = AI
-            #     ai_move_str = engine.get_best_move_from_stockfish(gs)
-            #     if ai_move_str:
-            #         start = (8 - int(ai_move_str[1]), ord(ai_move_str[0]) - ord('a'))
-            #         end = (8 - int(ai_move_str[3]), ord(ai_move_str[2]) - ord('a'))
-            #         ai_move = engine.Moves(start, end, gs.board)
-            #         aiLastMove=ai_move
-            #         gs.makeMove(ai_move)
-            #         moveMade = True
-
-        drawGameState(screen, gs,validmoves,sqSelected,aiLastMove)
-        gs.CheckForMate()
-
-        if gs.checkMate:
-            gameOver=True
-            if gs.whiteMove:
-                drawText(screen,'Black Wins by Checkmate')
-            else:
-                drawText(screen,'White Wins by Checkmate')
-        if gs.staleMate:
-            gameOver=True
-            drawText(screen,'Congratulations, Nobody Wins')
-        clock.tick(max_fps)
-        p.display.flip()
+            #     ai_move_str = engine.get_best_move_from_stockfish(gs)  # book move first, then the stockfish pool
+            #     for ai_move in validmoves:
+            #         if ai_move.getNotation() == ai_move_str:
+            #             aiLastMove=ai_move
+            #             gs.makeMove(ai_move)
+            #             moveMade = True
+            #     p.event.post(p.event.Event(p.USEREVENT))  # wake the loop up to handle the move instead of waiting
+
+        if needsDraw:
+            renderer.draw(gs,validmoves,sqSelected,aiLastMove,status)
+            needsDraw=False
         # if gameOver:
         #     running = False
 
+def gameStatus(gs):
+    #the text to show over the board, None while the game goes on
+    gs.CheckForMate()
+    if gs.checkMate:
+        return 'Black Wins by Checkmate' if gs.whiteMove else 'White Wins by Checkmate'
+    if gs.staleMate:
+        return 'Congratulations, Nobody Wins'
+    if gs.drawReason:
+        return 'Draw by '+gs.drawReason
+    return None
+
+class BoardRenderer:
+    #Draws the position when something changed and only the squares that changed. The empty board and the
+    #highlight squares are built once; a square is restored by copying it from the board surface, then its
+    #highlights and piece go on top, and only those rectangles are pushed to the display.
+    def __init__(self,screen):
+        self.screen=screen
+        self.board=p.Surface((width,height))
+        drawBoard(self.board)
+        self.highlights={}
+        for color in ('blue','yellow','orange'):
+            s=p.Surface((square_size,square_size))
+            s.set_alpha(100)
+            s.fill(p.Color(color))
+            self.highlights[color]=s
+        self.drawn=None #(piece, highlight colors) of every square as last drawn, None when the screen is stale
+        self.text=None
+
+    def invalidate(self):
+        #something else drew over the window, the next draw repaints all of it
+        self.drawn=None
+
+    def squareStates(self,gs,validMoves,sqSelected,aiLastMove):
+        marks={}
+        rows=gs.boardRows()
+        if sqSelected!=():
+            i,j=sqSelected
+            if rows[i][j][0]==('w' if gs.whiteMove else 'b'):
+                marks[sqSelected]=('blue',)
+                for move in validMoves:
+                    if move.startRow==i and move.startCol==j:
+                        marks[(move.endRow,move.endCol)]=marks.get((move.endRow,move.endCol),())+('yellow',)
+        if aiLastMove is not None:
+            for square in ((aiLastMove.startRow,aiLastMove.startCol),(aiLastMove.endRow,aiLastMove.endCol)):
+                marks[square]=marks.get(square,())+('orange',)
+        return [[(rows[i][j],marks.get((i,j),())) for j in range(dimension)] for i in range(dimension)]
+
+    def draw(self,gs,validMoves,sqSelected,aiLastMove,text=None):
+        #returns the rectangles that were redrawn
+        states=self.squareStates(gs,validMoves,sqSelected,aiLastMove)
+        full=self.drawn is None or text!=self.text
+        dirty=[]
+        for i in range(dimension):
+            for j in range(dimension):
+                state=states[i][j]
+                if full or state!=self.drawn[i][j]:
+                    rect=p.Rect(j*square_size,i*square_size,square_size,square_size)
+                    self.screen.blit(self.board,rect,rect)
+                    for color in state[1]:
+                        self.screen.blit(self.highlights[color],rect)
+                    if state[0]!='--':
+                        self.screen.blit(images[state[0]],rect)
+                    dirty.append(rect)
+        if text and dirty:
+            drawText(self.screen,text)
+        self.drawn=states
+        self.text=text
+        if full:
+            p.display.flip()
+        elif dirty:
+            p.display.update(dirty)
+        return dirty
+
+def choosePromotion(screen,clock,whiteMove):
+    #draws the four pieces across the middle of the board and waits for a click, None if the player cancels
+    color='w' if whiteMove else 'b'
+    choices='qrbn'
+    top=height//2-square_size//2
+    left=width//2-2*square_size
+    panel=p.Surface((4*square_size,square_size))
+    panel.fill(p.Color('light gray'))
+    screen.blit(panel,(left,top))
+    for k,piece in enumerate(choices):
+        screen.blit(images[color+piece],p.Rect(left+k*square_size,top,square_size,square_size))
+    p.display.flip()
+    while True:
+        for e in p.event.get():
+            if e.type==p.QUIT:
+                p.event.post(e)
+                return None
+            elif e.type==p.KEYDOWN:
+                if e.key==p.K_ESCAPE:
+                    return None
+                if p.key.name(e.key) in choices:
+                    return p.key.name(e.key)
+            elif e.type==p.MOUSEBUTTONDOWN:
+                x,y=e.pos
+                if top<=y<top+square_size and left<=x<left+4*square_size:
+                    return choices[(x-left)//square_size]
+                return None
+        clock.tick(max_fps)
+
 def highlightSquares(screen,gs,validmoves,sqSelected):
     if sqSelected!=():
         i,j=sqSelected
@@ -142,7 +258,10 @@ def drawPieces(screen,board):
                 screen.blit(images[piece],p.Rect(j*square_size,i*square_size,square_size,square_size))
 
 def drawText(screen,text):
-    font=p.font.SysFont("Calibri",32,True,False)
+    #looking the font up is slow, so it is done once
+    if 'text' not in fonts:
+        fonts['text']=p.font.SysFont("Calibri",32,True,False)
+    font=fonts['text']
     textObject=font.render(text,0,p.Color('Black'))
     textLocation=p.Rect(0,0,width,height).move(width/2-textObject.get_width()/2,height/2-textObject.get_height()/2)
     screen.blit(textObject,textLocation)
@@ -0,0 +1,73 @@
+from array import array
+from collections import OrderedDict
+
+import engine
+import movecode
+
+# Per-process legal move cache. GameState.getValid asks engine.moveCache (None unless enable() was called) before
+# generating anything, so a position seen before - after an undo, a second look from CheckForMate, a transposition in
+# search - costs a dict lookup and rebuilding its Moves instead of checkPinsChecks + getAllMoves.
+# Entries are keyed by the Zobrist hash, which covers the pieces, side to move, castling rights and the en passant file
+# whenever a pawn can take, so positions share an entry only when they have the same legal moves. Moves are kept as
+# packed 16-bit codes (movecode.py), about two bytes per move, and the least recently used positions are dropped once
+# the estimated size passes maxBytes.
+
+ENTRY_OVERHEAD = 200  # bytes per entry besides the codes: the dict slot, key, tuple and bytes object headers
+
+
+class MoveCache:
+    def __init__(self, maxBytes=16 << 20):
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()  # hash -> (packed codes, in check), least recently used first
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def lookup(self, gs):
+        # the position's legal moves as Moves objects, None if it isn't cached. Sets gs.inCheck like getValid.
+        entry = self.entries.get(gs.zobristHash)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(gs.zobristHash)
+        self.hits += 1
+        codes, gs.inCheck = entry
+        board = gs.boardRows()
+        toMoves = movecode.toMoves
+        return [toMoves(code, board) for code in memoryview(codes).cast('H')]
+
+    def store(self, gs, moves):
+        key = gs.zobristHash
+        if key in self.entries:
+            return
+        codes = array('H', [movecode.fromMoves(move) for move in moves]).tobytes()
+        self.entries[key] = (codes, gs.inCheck)
+        self.bytes += ENTRY_OVERHEAD + len(codes)
+        while self.bytes > self.maxBytes and self.entries:
+            _, (oldCodes, _) = self.entries.popitem(last=False)
+            self.bytes -= ENTRY_OVERHEAD + len(oldCodes)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hitRate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions, 'entries': len(self.entries), 'bytes': self.bytes,
+                'maxBytes': self.maxBytes}
+
+
+def enable(maxBytes=16 << 20):
+    # turns the cache on for every position in this process and returns it
+    if engine.moveCache is None or engine.moveCache.maxBytes != maxBytes:
+        engine.moveCache = MoveCache(maxBytes)
+    return engine.moveCache
+
+
+def disable():
+    engine.moveCache = None
+
+
+def stats():
+    return engine.moveCache.stats() if engine.moveCache is not None else None
@@ -0,0 +1,66 @@
+from array import array
+from engine import Moves
+
+# Packed 16-bit moves, so generators can write plain integers into a preallocated array instead of building a
+# Moves object (and reading two strings off the board) for every candidate.
+#   bits 0-5   start square (row*8 + col, same numbering as bitboard.py)
+#   bits 6-11  end square
+#   bits 12-13 promotion piece, index into promotionPieces (only meaningful for PROMOTION)
+#   bits 14-15 move kind
+NORMAL, PROMOTION, EN_PASSANT, CASTLING = 0, 1 << 14, 2 << 14, 3 << 14
+KIND_MASK = 3 << 14
+promotionPieces = 'nbrq'
+
+MAX_MOVES = 256  # no legal position has more than 218 moves
+
+
+def newMoveList():
+    return array('H', bytes(2 * MAX_MOVES))
+
+
+def encode(start, end, kind=NORMAL, promotion='q'):
+    code = start | end << 6 | kind
+    if kind == PROMOTION:
+        code |= promotionPieces.index(promotion) << 12
+    return code
+
+
+def startSquare(code):
+    return code & 63
+
+
+def endSquare(code):
+    return code >> 6 & 63
+
+
+def promotionPiece(code):
+    return promotionPieces[code >> 12 & 3]
+
+
+def notation(code):
+    start, end = code & 63, code >> 6 & 63
+    text = Moves.colsToFiles[start & 7] + Moves.rowsToRanks[start >> 3] + \
+        Moves.colsToFiles[end & 7] + Moves.rowsToRanks[end >> 3]
+    if code & KIND_MASK == PROMOTION:
+        text += promotionPieces[code >> 12 & 3]
+    return text
+
+
+def toMoves(code, board):
+    # Moves view of a packed move for the UI and everything else that works with Moves objects
+    start, end, kind = code & 63, code >> 6 & 63, code & KIND_MASK
+    return Moves((start >> 3, start & 7), (end >> 3, end & 7), board,
+                 enPassant=kind == EN_PASSANT, pawnPromotion=kind == PROMOTION, Castling=kind == CASTLING,
+                 promotionPiece=promotionPieces[code >> 12 & 3])
+
+
+def fromMoves(move):
+    if move.enPassant:
+        kind = EN_PASSANT
+    elif move.pawnPromotion:
+        kind = PROMOTION
+    elif move.Castling:
+        kind = CASTLING
+    else:
+        kind = NORMAL
+    return encode(move.startRow * 8 + move.startCol, move.endRow * 8 + move.endCol, kind, move.promotionPiece)
@@ -0,0 +1,125 @@
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from backends import backends
+from perft import perft
+from search import evaluate
+
+# Spreads engine work over worker processes. Positions cross the process boundary as FEN strings and moves as
+# coordinate notation (e2e4, e7e8q), every worker rebuilds its own GameState from those, so nothing mutable is
+# shared. Perft is split by root move, batches of FENs are split into chunks.
+
+
+def perftMove(task):
+    # worker: perft below one root move
+    fen, notation, depth, backend = task
+    gs = backends[backend].from_fen(fen)
+    for move in gs.getValid():
+        if move.getNotation() == notation:
+            gs.makeMove(move)
+            return notation, perft(gs, depth - 1)
+    raise ValueError("%s is not legal in %s" % (notation, fen))
+
+
+def parallelPerft(fen, depth, workers=None, backend='bitboard'):
+    # returns (total nodes, {root move: nodes}), the same numbers as perft/divide on one core
+    if depth < 1:
+        return 1, {}
+    rootMoves = [move.getNotation() for move in backends[backend].from_fen(fen).getValid()]
+    with ProcessPoolExecutor(workers) as pool:
+        counts = dict(pool.map(perftMove, [(fen, notation, depth, backend) for notation in rootMoves]))
+    return sum(counts.values()), counts
+
+
+def evaluateFEN(gs):
+    # (legal moves, in check, checkmate, stalemate, static eval for the side to move)
+    moves = gs.getValid()
+    return (len(moves), gs.inCheck, not moves and gs.inCheck, not moves and not gs.inCheck,
+            evaluate(gs) if moves else 0)
+
+
+def evaluateChunk(task):
+    # worker: one chunk of FENs, results come back in the same order
+    fens, backend = task
+    backend = backends[backend]
+    return [evaluateFEN(backend.from_fen(fen)) for fen in fens]
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def evaluateBatch(fens, workers=None, backend='bitboard', chunkSize=256):
+    # yields evaluateFEN's tuple for every FEN in order. fens can be any iterable (a file, a generator), only
+    # a few chunks per worker are in flight at once so millions of positions don't all sit in memory.
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as pool:
+        pending = []
+        for chunk in chunked(fens, chunkSize):
+            pending.append(pool.submit(evaluateChunk, (chunk, backend)))
+            if len(pending) >= 4 * workers:
+                # oldest first keeps the output in order, later chunks keep running in the meantime
+                yield from pending.pop(0).result()
+        for future in pending:
+            yield from future.result()
+
+
+def withFENs(fens, workers, backend):
+    # pairs every FEN with its result without reading the input twice
+    pending = deque()
+
+    def remember(iterable):
+        for fen in iterable:
+            pending.append(fen)
+            yield fen
+    for result in evaluateBatch(remember(fens), workers, backend):
+        yield pending.popleft(), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft and position evaluation on every core")
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per core)")
+    parser.add_argument('--backend', choices=sorted(backends), default='bitboard')
+    commands = parser.add_subparsers(dest='command', required=True)
+    perftParser = commands.add_parser('perft', help="perft split by root move")
+    perftParser.add_argument('fen')
+    perftParser.add_argument('depth', type=int)
+    perftParser.add_argument('--divide', action='store_true', help="print the count below each root move")
+    evalParser = commands.add_parser('eval', help="legal moves, mate/stalemate and eval for one FEN per line")
+    evalParser.add_argument('file', help="file of FENs, - for stdin")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'perft':
+        nodes, counts = parallelPerft(args.fen, args.depth, args.workers, args.backend)
+        if args.divide:
+            for notation in sorted(counts):
+                print(notation, counts[notation])
+        seconds = time.perf_counter() - start
+        print("%d nodes in %.3fs (%d nps)" % (nodes, seconds, nodes / seconds if seconds else 0))
+        return
+
+    f = sys.stdin if args.file == '-' else open(args.file)
+    with f:
+        fens = (line.strip() for line in f if line.strip())
+        count = 0
+        for fen, result in withFENs(fens, args.workers, args.backend):
+            print("%s ; moves %d check %d mate %d stalemate %d eval %d" % ((fen,) + result))
+            count += 1
+    seconds = time.perf_counter() - start
+    print("%d positions in %.3fs (%.0f/s)" % (count, seconds, count / seconds if seconds else 0), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import movecode
+import profiling
+from backends import backends
+
+# Perft (performance test) counts every leaf of the legal move tree to a fixed depth. The node counts of the
+# reference positions below are known exactly, so a mismatch means move generation is broken, and the time it
+# takes to get there tells us whether getValid/makeMove/undoMove got faster or slower.
+
+# name, FEN, {depth: nodes}. The standard positions come from the chessprogramming wiki perft results page,
+# the rest are small positions that each target one rule (illegal en passant, promotions, castling through check).
+referencePositions = [
+    ("initial", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     {1: 20, 2: 400, 3: 8902, 4: 197281}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862}),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238}),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467}),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1: 44, 2: 1486, 3: 62379}),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890}),
+    ("illegal-ep-pin", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",
+     {1: 18, 2: 92, 3: 1670, 4: 10138}),
+    ("ep-discovered-check", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1",
+     {1: 13, 2: 102, 3: 1266, 4: 10276}),
+    ("ep-gives-check", "8/5bk1/8/2Pp4/8/1K6/8/8 w - d6 0 1",
+     {1: 8, 2: 104, 3: 736, 4: 9287}),
+    ("ep-out-of-check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1",
+     {1: 15, 2: 126, 3: 1928, 4: 13931}),
+    ("promote-out-of-check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1",
+     {1: 11, 2: 133, 3: 1442, 4: 19174}),
+    ("promote-to-check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1",
+     {1: 9, 2: 40, 3: 472, 4: 2661}),
+    ("underpromotion", "8/P1k5/K7/8/8/8/8/8 w - - 0 1",
+     {1: 6, 2: 27, 3: 273, 4: 1329}),
+    ("castle-through-check", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1",
+     {1: 26, 2: 1141, 3: 27826}),
+    ("castle-rights-lost", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1",
+     {1: 44, 2: 1494, 3: 50509}),
+    ("castle-gives-check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1",
+     {1: 15, 2: 66, 3: 1198, 4: 6399}),
+    ("pinned-pawn-to-king", "1R6/8/1p6/4K3/1k6/4P3/8/4r3 w - - 0 1",
+     {1: 18, 2: 301, 3: 5376, 4: 91949}),
+    ("pinned-ep-to-king", "7k/2K5/8/3pP3/8/6b1/8/8 w - d6 0 1",
+     {1: 9, 2: 90, 3: 644, 4: 7617}),
+]
+
+# the methods timed by the phase breakdown, in the order they're reported (piece generators follow)
+phases = profiling.methodNames
+
+
+def perft(gs, depth):
+    # backends that can generate packed moves (bitboard) are walked with those instead of Moves objects
+    if hasattr(gs, 'generateMoves'):
+        return perftEncoded(gs, depth, [movecode.newMoveList() for _ in range(max(depth, 1))])
+    moves = gs.getValid()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+def perftEncoded(gs, depth, buffers):
+    # one preallocated move list per ply, so the walk allocates no move objects at all
+    buffer = buffers[depth - 1] if depth > 0 else buffers[0]
+    count = gs.generateMoves(buffer)
+    if depth <= 1:
+        return count if depth == 1 else 1
+    nodes = 0
+    for i in range(count):
+        gs.makeMove(buffer[i])
+        nodes += perftEncoded(gs, depth - 1, buffers)
+        gs.undoMove()
+    return nodes
+
+
+def divide(gs, depth):
+    # node count below each root move, the usual way to find which move a generator gets wrong
+    counts = {}
+    if hasattr(gs, 'generateMoves'):
+        buffer = movecode.newMoveList()
+        for i in range(gs.generateMoves(buffer)):
+            code = buffer[i]
+            gs.makeMove(code)
+            counts[movecode.notation(code)] = perft(gs, depth - 1)
+            gs.undoMove()
+        return counts
+    for move in gs.getValid():
+        gs.makeMove(move)
+        counts[move.getNotation()] = counts.get(move.getNotation(), 0) + perft(gs, depth - 1)
+        gs.undoMove()
+    return counts
+
+
+def runPosition(name, fen, depth, expected, backend):
+    gs = backends[backend].from_fen(fen)
+    start = time.perf_counter()
+    nodes = perft(gs, depth)
+    seconds = time.perf_counter() - start
+
+    # second, instrumented pass so the wrappers don't skew the nodes/second figure
+    # Phases nest, so they overlap: getValid's time includes checkPinsChecks and getAllMoves (generateMoves on the
+    # bitboard backend), and getAllMoves' includes the piece generators it calls.
+    gs = backends[backend].from_fen(fen)
+    with profiling.profile(gs) as prof:
+        perft(gs, depth)
+    stats = prof.asDict()
+    return {
+        'name': name, 'fen': fen, 'backend': backend, 'depth': depth,
+        'nodes': nodes, 'expected': expected, 'ok': nodes == expected,
+        'seconds': round(seconds, 6), 'nps': round(nodes / seconds) if seconds > 0 else None,
+        'phases': stats['timings'], 'counters': stats['counters'],
+    }
+
+
+def runSuite(backend='numpy', maxDepth=None, names=None):
+    results = []
+    for name, fen, counts in referencePositions:
+        if names and name not in names:
+            continue
+        depth = max(counts) if maxDepth is None else min(maxDepth, max(counts))
+        results.append(runPosition(name, fen, depth, counts[depth], backend))
+    return results
+
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def printResults(results):
+    print("%-22s %-8s %5s %10s %10s %9s %10s" % ('position', 'backend', 'depth', 'nodes', 'expected', 'seconds',
+                                                  'nps'))
+    for r in results:
+        print("%-22s %-8s %5d %10d %10d %9.3f %10s %s" % (r['name'], r['backend'], r['depth'], r['nodes'],
+                                                          r['expected'], r['seconds'], r['nps'],
+                                                          '' if r['ok'] else 'MISMATCH'))
+    totalNodes = sum(r['nodes'] for r in results)
+    totalSeconds = sum(r['seconds'] for r in results)
+    print("total %d nodes in %.3fs (%d nps), %d/%d positions correct" % (
+        totalNodes, totalSeconds, totalNodes / totalSeconds if totalSeconds else 0,
+        sum(r['ok'] for r in results), len(results)))
+    names = [p for p in phases if any(p in r['phases'] for r in results)]
+    names += sorted({p for r in results for p in r['phases']} - set(names))
+    for phase in names:
+        calls = sum(r['phases'][phase]['calls'] for r in results if phase in r['phases'])
+        seconds = sum(r['phases'][phase]['seconds'] for r in results if phase in r['phases'])
+        print("  %-16s %9d calls %9.3fs" % (phase, calls, seconds))
+    counters = {}
+    for r in results:
+        for name, n in r['counters'].items():
+            counters[name] = counters.get(name, 0) + n
+    for name in sorted(counters):
+        print("  %-16s %9d" % (name, counters[name]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft correctness and move generation benchmark")
+    parser.add_argument('--backend', choices=sorted(backends) + ['all'], default='numpy')
+    parser.add_argument('--depth', type=int, help="cap every position at this depth")
+    parser.add_argument('--position', action='append', help="only run the named reference position(s)")
+    parser.add_argument('--json', help="write machine-readable results to this file")
+    parser.add_argument('--divide', metavar='FEN', help="print per-root-move counts for FEN at --depth")
+    args = parser.parse_args()
+
+    if args.divide:
+        gs = backends['numpy' if args.backend == 'all' else args.backend].from_fen(args.divide)
+        counts = divide(gs, args.depth or 1)
+        for notation in sorted(counts):
+            print(notation, counts[notation])
+        print("total", sum(counts.values()))
+        return
+
+    results = []
+    for backend in (sorted(backends) if args.backend == 'all' else [args.backend]):
+        results += runSuite(backend, args.depth, args.position)
+    printResults(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'commit': gitCommit(), 'python': platform.python_version(), 'timestamp': time.time(),
+                       'results': results}, f, indent=2)
+    if not all(r['ok'] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
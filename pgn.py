@@ -0,0 +1,202 @@
+import argparse
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from backends import backends
+
+# Streaming PGN reader. Games are read one at a time (headers + movetext), so a file of any size is processed in
+# constant memory, and every SAN move is resolved against getValid() of the current position, which also checks
+# that the game is legal. importFile fans the games out to a process pool and reports throughput and the games
+# whose moves don't resolve.
+
+headerPattern = re.compile(r'^\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]')
+sanPattern = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?[+#]*[!?]*$')
+castlePattern = re.compile(r'^([O0]-[O0](-[O0])?)[+#]*[!?]*$')
+# comments, variations and annotation glyphs are skipped, variations can nest
+commentPattern = re.compile(r'\{[^}]*\}|;[^\n]*')
+moveNumberPattern = re.compile(r'^\d+\.+')
+results = ('1-0', '0-1', '1/2-1/2', '*')
+
+
+class PGNError(Exception):
+    def __init__(self, message, san=None, ply=None):
+        Exception.__init__(self, message)
+        self.san = san
+        self.ply = ply
+
+
+class IllegalMove(PGNError):
+    pass
+
+
+class AmbiguousMove(PGNError):
+    pass
+
+
+def openPGN(source):
+    # accepts a path or an already open text file
+    if isinstance(source, str):
+        return open(source, encoding='utf-8-sig', errors='replace')
+    return source
+
+
+def readGames(source):
+    # yields (headers, movetext) for every game in the file. Lines stay separate so a ; comment ends with its line
+    f = openPGN(source)
+    try:
+        headers, movetext = {}, []
+        for line in f:
+            line = line.strip()
+            if line.startswith('['):
+                if movetext:
+                    yield headers, '\n'.join(movetext)
+                    headers, movetext = {}, []
+                match = headerPattern.match(line)
+                if match:
+                    headers[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+            elif line and not line.startswith('%'):
+                movetext.append(line)
+        if headers or movetext:
+            yield headers, '\n'.join(movetext)
+    finally:
+        if f is not source:
+            f.close()
+
+
+def sanTokens(movetext):
+    # the mainline SAN moves of a game, without move numbers, comments, variations, NAGs or the result
+    depth = 0
+    for token in commentPattern.sub(' ', movetext).replace('(', ' ( ').replace(')', ' ) ').split():
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth == 0 and not token.startswith('$') and token not in results:
+            token = moveNumberPattern.sub('', token)
+            if token:
+                yield token
+
+
+def sanToMove(gs, san, validMoves=None):
+    # the move from validMoves (getValid() by default) that the SAN string describes
+    if validMoves is None:
+        validMoves = gs.getValid()
+    castle = castlePattern.match(san)
+    if castle:
+        endCol = 2 if castle.group(2) else 6
+        candidates = [m for m in validMoves if m.Castling and m.endCol == endCol]
+    else:
+        match = sanPattern.match(san)
+        if not match:
+            raise IllegalMove("can't parse move %r" % san, san)
+        piece, fromFile, fromRank, target, promotion = match.groups()
+        piece = piece.lower() if piece else 'p'
+        endRow, endCol = 8 - int(target[1]), ord(target[0]) - ord('a')
+        candidates = []
+        for m in validMoves:
+            if m.endRow != endRow or m.endCol != endCol or m.pieceMoved[1] != piece or m.Castling:
+                continue
+            if fromFile and m.startCol != ord(fromFile) - ord('a'):
+                continue
+            if fromRank and m.startRow != 8 - int(fromRank):
+                continue
+            if promotion and not m.pawnPromotion:
+                continue
+            if m.pawnPromotion and m.promotionPiece != (promotion or 'Q').lower():
+                continue
+            candidates.append(m)
+    if not candidates:
+        raise IllegalMove("%r is not legal in %s" % (san, gs.getFEN()), san)
+    if len(candidates) > 1:
+        raise AmbiguousMove("%r matches %s in %s" % (san, ', '.join(m.getNotation() for m in candidates),
+                                                     gs.getFEN()), san)
+    return candidates[0]
+
+
+def replay(headers, movetext, backend='bitboard'):
+    # yields (gs, move, san) for every mainline move, gs is the position before the move, which is made once the
+    # consumer asks for the next one. Raises PGNError (with .ply set) at the first move that doesn't resolve.
+    gs = backends[backend].from_fen(headers['FEN']) if 'FEN' in headers else backends[backend]()
+    for ply, san in enumerate(sanTokens(movetext)):
+        try:
+            move = sanToMove(gs, san)
+        except PGNError as e:
+            e.ply = ply
+            raise
+        yield gs, move, san
+        gs.makeMove(move)
+
+
+def iterMoves(source, backend='bitboard', errors=None):
+    # yields (game index, headers, gs, move, san) over a whole file. Games stop at their first bad move, which is
+    # appended to errors as (game index, error) when a list is given.
+    for index, (headers, movetext) in enumerate(readGames(source)):
+        try:
+            for gs, move, san in replay(headers, movetext, backend):
+                yield index, headers, gs, move, san
+        except PGNError as e:
+            if errors is not None:
+                errors.append((index, e))
+
+
+def checkGame(game):
+    # process pool worker: replays one game, returns (index, plies, error description or None)
+    index, headers, movetext, backend = game
+    plies = 0
+    try:
+        for _ in replay(headers, movetext, backend):
+            plies += 1
+    except PGNError as e:
+        return index, plies, (type(e).__name__, e.ply, e.san, str(e))
+    return index, plies, None
+
+
+def importFile(source, workers=None, backend='bitboard', maxPending=None):
+    # replays every game on a process pool. At most maxPending games are in flight, so memory stays bounded no
+    # matter how big the file is.
+    maxPending = maxPending or 4 * (workers or 4)
+    stats = {'games': 0, 'plies': 0, 'errors': [], 'seconds': 0.0}
+    start = time.perf_counter()
+
+    def collect(done):
+        for future in done:
+            index, plies, error = future.result()
+            stats['games'] += 1
+            stats['plies'] += plies
+            if error is not None:
+                stats['errors'].append((index,) + error)
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        for index, (headers, movetext) in enumerate(readGames(source)):
+            if len(pending) >= maxPending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(pool.submit(checkGame, (index, headers, movetext, backend)))
+        collect(wait(pending)[0])
+    stats['errors'].sort()
+    stats['seconds'] = time.perf_counter() - start
+    stats['gamesPerSecond'] = stats['games'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay and validate every game in a PGN file")
+    parser.add_argument('pgn')
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per core)")
+    parser.add_argument('--backend', choices=sorted(backends), default='bitboard')
+    args = parser.parse_args()
+
+    stats = importFile(args.pgn, args.workers, args.backend)
+    for index, kind, ply, san, message in stats['errors']:
+        print("game %d, ply %d: %s: %s" % (index + 1, ply + 1, kind, message))
+    print("%d games, %d plies in %.3fs (%.1f games/s), %d with illegal or ambiguous moves" % (
+        stats['games'], stats['plies'], stats['seconds'], stats['gamesPerSecond'], len(stats['errors'])))
+    if stats['errors']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
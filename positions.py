@@ -0,0 +1,295 @@
+import argparse
+import json
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import movecode
+import pgn
+import polyglot
+from parallel import chunked
+from backends import backends
+
+# On-disk position index: which stored games reached a position, and what was played next.
+# Every position of every imported game is an entry (position key, game id, ply, next move), the next move packed as
+# in movecode.py and NO_MOVE for the last position of a game. Entries live in segments, each a pair of files sorted
+# by hash: <name>.keys holds the uint64 hashes and <name>.vals the (game, ply, move) records in the same order, so a
+# lookup memory-maps the keys and binary-searches them (np.searchsorted) without reading the rest of the file.
+# Every batch of imported games becomes a new segment and segments of similar size are merged, so there are only
+# ever about log2(positions / batch) of them and an import never rewrites the whole index. index.json lists the
+# segments, games.jsonl holds the headers of game i on line i (games.offsets points at each line) and games.results
+# one result byte per game for the next-move statistics.
+
+NO_MOVE = 0xFFFF
+valueType = np.dtype([('game', '<u4'), ('ply', '<u2'), ('move', '<u2')])
+resultCodes = {'1-0': 1, '0-1': 2, '1/2-1/2': 3}  # anything else (*, missing) is 0
+
+
+def startPosition(headers, backend):
+    return backends[backend].from_fen(headers['FEN']) if 'FEN' in headers else backends[backend]()
+
+
+def gameEntries(task):
+    # process pool worker: replays a chunk of games, returns (headers, hashes, moves, error) per game. hashes[i] is
+    # the position before moves[i], ply i, and the final position closes the list with NO_MOVE. A game with a bad
+    # move is kept up to the position where it went wrong.
+    games, backend = task
+    results = []
+    for headers, movetext in games:
+        keys, moves = array('Q'), array('H')
+        gs, error = None, None
+        try:
+            for gs, move, san in pgn.replay(headers, movetext, backend):
+                keys.append(polyglot.polyglotKey(gs))
+                moves.append(movecode.fromMoves(move))
+        except pgn.PGNError as e:
+            error = (type(e).__name__, e.ply, e.san, str(e))
+        if gs is None:
+            gs = startPosition(headers, backend)
+        keys.append(polyglot.polyglotKey(gs))
+        moves.append(NO_MOVE)
+        results.append((headers, keys.tobytes(), moves.tobytes(), error))
+    return results
+
+
+def positionKey(position):
+    # accepts a key, a FEN or a GameState of either backend. Positions are keyed by their Polyglot key, which only
+    # counts the en passant file when a pawn can take, so transpositions after an untakeable double push and FENs
+    # written with or without that en passant square find the same games
+    if isinstance(position, int):
+        return position
+    if isinstance(position, str):
+        position = backends['bitboard'].from_fen(position)
+    return polyglot.polyglotKey(position)
+
+
+class PositionIndex:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = {'segments': [], 'nextSegment': 0, 'positions': 0}
+        if os.path.isfile(self.path('index.json')):
+            with open(self.path('index.json')) as f:
+                self.manifest = json.load(f)
+        self.openSegments()
+        self.pending = ([], array('Q'), array('I'), array('H'), array('H'))  # headers, keys, games, plies, moves
+        self.gameCount = os.path.getsize(self.path('games.offsets')) // 8 if os.path.isfile(
+            self.path('games.offsets')) else 0
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def openSegments(self):
+        # [(keys, vals)] memory maps, oldest segment first
+        self.segments = [(np.memmap(self.path(name + '.keys'), dtype='<u8', mode='r'),
+                          np.memmap(self.path(name + '.vals'), dtype=valueType, mode='r'))
+                         for name in self.manifest['segments']]
+
+    def __len__(self):
+        return self.manifest['positions'] + len(self.pending[1])
+
+    # --- lookups
+
+    def matches(self, position):
+        # (game, ply, move) records of every stored position with this hash, oldest games first
+        key = np.uint64(positionKey(position))
+        found = []
+        for keys, vals in self.segments:
+            lo = np.searchsorted(keys, key, 'left')
+            hi = np.searchsorted(keys, key, 'right')
+            if hi > lo:
+                found.append(vals[lo:hi])
+        if not found:
+            return np.zeros(0, dtype=valueType)
+        return np.concatenate(found)
+
+    def games(self, position, limit=None):
+        # [(game id, ply, next move in coordinate notation or None)] for the games that reached the position
+        records = self.matches(position)[:limit]
+        return [(int(game), int(ply), None if move == NO_MOVE else movecode.notation(int(move)))
+                for game, ply, move in records.tolist()]
+
+    def nextMoves(self, position):
+        # [(next move, games, white wins, draws, black wins)] most played first, None as the move counts the games
+        # that ended in the position
+        records = self.matches(position)
+        if not len(records):
+            return []
+        results = self.results()[records['game']]
+        moves, inverse = np.unique(records['move'], return_inverse=True)
+        stats = np.zeros((len(moves), 4), dtype=np.int64)
+        np.add.at(stats, (inverse, results), 1)
+        rows = [(None if move == NO_MOVE else movecode.notation(int(move)), int(row.sum()), int(row[1]), int(row[3]),
+                 int(row[2])) for move, row in zip(moves.tolist(), stats)]
+        rows.sort(key=lambda row: -row[1])
+        return rows
+
+    def results(self):
+        if not self.gameCount:
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(self.path('games.results'), dtype=np.uint8, mode='r')
+
+    def gameHeaders(self, gameId):
+        offsets = np.memmap(self.path('games.offsets'), dtype='<u8', mode='r')
+        with open(self.path('games.jsonl'), 'rb') as f:
+            f.seek(int(offsets[gameId]))
+            return json.loads(f.readline())
+
+    # --- building
+
+    def addGame(self, headers, keys, moves):
+        # queues one replayed game (hashes and packed next moves as from gameEntries), returns its id
+        gameId = self.gameCount + len(self.pending[0])
+        pendingHeaders, pendingKeys, pendingGames, pendingPlies, pendingMoves = self.pending
+        pendingHeaders.append(headers)
+        pendingKeys.extend(keys)
+        pendingGames.extend([gameId] * len(keys))
+        pendingPlies.extend(range(len(keys)))
+        pendingMoves.extend(moves)
+        return gameId
+
+    def addFile(self, source, workers=None, backend='bitboard', batchSize=1000000, chunkSize=64):
+        # imports every game of a PGN file, writing a segment whenever batchSize positions are queued. Games are
+        # replayed on a process pool with a few chunks per worker in flight, and get ids in file order.
+        stats = {'games': 0, 'positions': 0, 'errors': []}
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(workers) as pool:
+            pending = []
+
+            def collect(future):
+                for headers, keys, moves, error in future.result():
+                    keys, codes = array('Q', keys), array('H', moves)
+                    gameId = self.addGame(headers, keys, codes)
+                    stats['games'] += 1
+                    stats['positions'] += len(keys)
+                    if error is not None:
+                        stats['errors'].append((gameId,) + error)
+                if len(self.pending[1]) >= batchSize:
+                    self.flush()
+            for chunk in chunked(pgn.readGames(source), chunkSize):
+                pending.append(pool.submit(gameEntries, (chunk, backend)))
+                if len(pending) >= 4 * workers:
+                    collect(pending.pop(0))
+            for future in pending:
+                collect(future)
+        self.flush()
+        return stats
+
+    def flush(self):
+        # writes the queued games and their positions: game tables first, then a new sorted segment, then the
+        # manifest, so an interrupted import never leaves entries pointing at games that aren't there
+        headers, keys, games, plies, moves = self.pending
+        if not headers:
+            return
+        offset = os.path.getsize(self.path('games.jsonl')) if os.path.isfile(self.path('games.jsonl')) else 0
+        offsets = array('Q')
+        with open(self.path('games.jsonl'), 'ab') as f:
+            for gameHeaders in headers:
+                offsets.append(offset)
+                line = json.dumps(gameHeaders, ensure_ascii=False).encode() + b'\n'
+                f.write(line)
+                offset += len(line)
+        with open(self.path('games.offsets'), 'ab') as f:
+            f.write(np.frombuffer(offsets, dtype=np.uint64).astype('<u8').tobytes())
+        with open(self.path('games.results'), 'ab') as f:
+            f.write(bytes(resultCodes.get(h.get('Result'), 0) for h in headers))
+
+        keyArray = np.frombuffer(keys, dtype=np.uint64)
+        values = np.empty(len(keyArray), dtype=valueType)
+        values['game'] = np.frombuffer(games, dtype=np.uint32)
+        values['ply'] = np.frombuffer(plies, dtype=np.uint16)
+        values['move'] = np.frombuffer(moves, dtype=np.uint16)
+        # stable, so records with the same hash stay in game order
+        order = np.argsort(keyArray, kind='stable')
+        name = self.writeSegment(keyArray[order], values[order])
+        self.gameCount += len(headers)
+        self.pending = ([], array('Q'), array('I'), array('H'), array('H'))
+        self.manifest['segments'].append(name)
+        self.manifest['positions'] += len(keyArray)
+        self.mergeSegments()
+        self.saveManifest()
+
+    def writeSegment(self, keys, values):
+        name = 'segment-%06d' % self.manifest['nextSegment']
+        self.manifest['nextSegment'] += 1
+        for suffix, data in (('.keys', keys.astype('<u8')), ('.vals', values)):
+            with open(self.path(name + suffix + '.tmp'), 'wb') as f:
+                f.write(data.tobytes())
+            os.replace(self.path(name + suffix + '.tmp'), self.path(name + suffix))
+        return name
+
+    def mergeSegments(self):
+        # merges the newest two segments while the newer one is at least half the size of the older one, so sizes
+        # stay roughly powers of two apart and every entry is rewritten O(log n) times in total
+        segments = self.manifest['segments']
+        while len(segments) >= 2 and 2 * self.segmentSize(segments[-1]) >= self.segmentSize(segments[-2]):
+            older, newer = segments[-2], segments[-1]
+            keys = np.concatenate([np.fromfile(self.path(older + '.keys'), dtype='<u8'),
+                                   np.fromfile(self.path(newer + '.keys'), dtype='<u8')])
+            values = np.concatenate([np.fromfile(self.path(older + '.vals'), dtype=valueType),
+                                     np.fromfile(self.path(newer + '.vals'), dtype=valueType)])
+            order = np.argsort(keys, kind='stable')
+            segments[-2:] = [self.writeSegment(keys[order], values[order])]
+            self.saveManifest()
+            for name in (older, newer):
+                for suffix in ('.keys', '.vals'):
+                    os.remove(self.path(name + suffix))
+
+    def segmentSize(self, name):
+        return os.path.getsize(self.path(name + '.keys')) // 8
+
+    def saveManifest(self):
+        with open(self.path('index.json.tmp'), 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(self.path('index.json.tmp'), self.path('index.json'))
+        self.openSegments()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the positions of PGN games and look positions up")
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help="append the games of a PGN file to an index")
+    add.add_argument('index', help="index directory (created if missing)")
+    add.add_argument('pgn')
+    add.add_argument('--workers', type=int, help="worker processes (default: one per core)")
+    add.add_argument('--batch', type=int, default=1000000, help="positions per new segment")
+    probe = commands.add_parser('probe', help="games that reached a position and the moves played next")
+    probe.add_argument('index')
+    probe.add_argument('fen')
+    probe.add_argument('--games', type=int, default=10, help="how many games to list")
+    args = parser.parse_args()
+
+    index = PositionIndex(args.index)
+    if args.command == 'add':
+        start = time.perf_counter()
+        stats = index.addFile(args.pgn, args.workers, batchSize=args.batch)
+        seconds = time.perf_counter() - start
+        for gameId, kind, ply, san, message in stats['errors']:
+            print("game %d, ply %d: %s: %s" % (gameId, ply + 1, kind, message), file=sys.stderr)
+        print("%d games, %d positions added in %.3fs, index holds %d positions in %d segments" % (
+            stats['games'], stats['positions'], seconds, len(index), len(index.manifest['segments'])))
+        return
+
+    start = time.perf_counter()
+    rows = index.nextMoves(args.fen)
+    games = index.games(args.fen, args.games)
+    seconds = time.perf_counter() - start
+    if not rows:
+        print("position not in the index", file=sys.stderr)
+        sys.exit(1)
+    print("%-8s %8s %7s %7s %7s" % ('move', 'games', 'white', 'draw', 'black'))
+    for move, count, white, draws, black in rows:
+        print("%-8s %8d %7d %7d %7d" % (move or '(end)', count, white, draws, black))
+    for gameId, ply, move in games:
+        headers = index.gameHeaders(gameId)
+        print("game %d ply %d next %s: %s - %s %s" % (gameId, ply, move or '-', headers.get('White', '?'),
+                                                      headers.get('Black', '?'), headers.get('Result', '*')))
+    print("looked up in %.2f ms" % (seconds * 1000), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
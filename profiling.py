@@ -0,0 +1,116 @@
+import json
+import time
+from contextlib import contextmanager
+
+# Opt-in instrumentation for move generation and engine calls. Nothing is timed normally: profile() swaps timing
+# wrappers onto the instance methods of the positions it is given and takes them off again when the block ends, so
+# positions outside a profile run the plain methods. Code that isn't a GameState method (the Stockfish pool) checks
+# `current` once per request.
+#
+#     with profiling.profile(gs) as prof:
+#         ...
+#     prof.asDict() / prof.toJSON()
+
+# GameState methods timed by profile(), the piece generators in moveFunctions are added to these
+methodNames = ['getValid', 'generateMoves', 'checkPinsChecks', 'getAllMoves', 'makeMove', 'undoMove']
+
+current = None  # innermost active Profile, None when nothing is being profiled
+
+
+class Profile:
+    def __init__(self):
+        self.timings = {}  # name -> [calls, seconds]
+        self.counters = {}
+        self.restore = []  # (gs, attribute, had its own, previous value) for every wrapper attach installed
+
+    def record(self, name, seconds):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = [0, 0.0]
+        timing[0] += 1
+        timing[1] += seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def timed(self, name, method, counter=None):
+        # wraps method so every call is recorded under name. With a counter, the result's len() (or the result
+        # itself for generateMoves, which returns a count) is added to that counter too.
+        clock = time.perf_counter
+        record = self.record
+        count = self.count
+
+        def wrapper(*args):
+            start = clock()
+            result = method(*args)
+            record(name, clock() - start)
+            if counter is not None:
+                count(counter, result if isinstance(result, int) else len(result))
+            return result
+        return wrapper
+
+    def attach(self, gs):
+        # time this position's methods until the profile ends
+        encoded = hasattr(gs, 'generateMoves')
+        # bitboard positions generate legal moves only, the NumPy generator produces candidates that getValid prunes
+        counters = {'generateMoves': 'movesLegal'} if encoded else {'getAllMoves': 'movesGenerated',
+                                                                      'getValid': 'movesLegal'}
+        for name in methodNames:
+            if hasattr(gs, name):
+                hadOwn = name in vars(gs)
+                previous = getattr(gs, name)
+                setattr(gs, name, self.timed(name, previous, counters.get(name)))
+                self.restore.append((gs, name, hadOwn, previous))
+        generators = getattr(gs, 'moveFunctions', None)
+        if generators:
+            original = dict(generators)
+            for piece, method in original.items():
+                generators[piece] = self.timed(method.__name__, method)
+            self.restore.append((gs, 'moveFunctions', None, original))
+
+    def detach(self):
+        for gs, name, hadOwn, previous in reversed(self.restore):
+            if name == 'moveFunctions':
+                gs.moveFunctions.update(previous)
+            elif hadOwn:
+                setattr(gs, name, previous)
+            else:
+                delattr(gs, name)
+        self.restore = []
+
+    def asDict(self):
+        counters = dict(self.counters)
+        if 'movesGenerated' in counters or 'movesLegal' in counters:
+            counters.setdefault('movesGenerated', counters.get('movesLegal', 0))
+            counters['movesPruned'] = counters['movesGenerated'] - counters.get('movesLegal', 0)
+        return {'timings': {name: {'calls': calls, 'seconds': round(seconds, 6)}
+                            for name, (calls, seconds) in self.timings.items()},
+                'counters': counters}
+
+    def toJSON(self, **kwargs):
+        return json.dumps(self.asDict(), **kwargs)
+
+
+@contextmanager
+def profile(*states):
+    # collects stats for the given positions (attach more with prof.attach) and any engine calls made meanwhile
+    global current
+    prof = Profile()
+    previous = current
+    current = prof
+    try:
+        for gs in states:
+            prof.attach(gs)
+        yield prof
+    finally:
+        prof.detach()
+        current = previous
+
+
+def engineTimer(prof, name='engine'):
+    # done callback for an engine Future: records the time from now until the result arrives
+    start = time.perf_counter()
+
+    def done(future):
+        prof.record(name, time.perf_counter() - start)
+    return done
@@ -0,0 +1,95 @@
+import argparse
+import os
+import statistics
+import time
+
+# Frame time and CPU use of the pygame UI: the old loop, which redraws everything and re-checks for mate on every
+# frame at max_fps, against BoardRenderer, which draws only what changed when something happens. Both replay the same
+# scripted session (select a piece, play the move, think for a while) on an off-screen display, so no window opens.
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame as p
+
+import engine
+import main as ui
+
+session = ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1c4', 'g8f6', 'f3g5', 'd7d5', 'e4d5', 'f6d5', 'g5f7', 'e8f7']
+
+
+def events(thinkSeconds):
+    # (seconds since the last event, selected square, move to play or None) for every click of the session
+    for notation in session:
+        start = (engine.Moves.ranksToRows[notation[1]], engine.Moves.filesToCols[notation[0]])
+        yield thinkSeconds, start, None
+        yield 0.5, (), notation
+
+
+def findMove(gs, notation):
+    return next(m for m in gs.getValid() if m.getNotation() == notation)
+
+
+def everyFrame(screen, thinkSeconds):
+    # the old main loop: max_fps full frames a second whether or not anything changed
+    gs = engine.GameState()
+    validMoves, selected, frames = gs.getValid(), (), []
+    for wait, square, notation in events(thinkSeconds):
+        for _ in range(max(1, int(wait * ui.max_fps))):
+            start = time.perf_counter()
+            ui.drawGameState(screen, gs, validMoves, selected, None)
+            gs.CheckForMate()
+            p.display.flip()
+            frames.append(time.perf_counter() - start)
+        if notation is None:
+            selected = square
+        else:
+            gs.makeMove(findMove(gs, notation))
+            validMoves, selected = gs.getValid(), ()
+    return frames
+
+
+def eventDriven(screen, thinkSeconds):
+    # BoardRenderer: one draw per event, nothing at all while waiting
+    gs = engine.GameState()
+    renderer = ui.BoardRenderer(screen)
+    validMoves, selected, frames = gs.getValid(), (), []
+    status = ui.gameStatus(gs)
+    renderer.draw(gs, validMoves, selected, None, status)
+    for wait, square, notation in events(thinkSeconds):
+        start = time.perf_counter()
+        if notation is None:
+            selected = square
+        else:
+            gs.makeMove(findMove(gs, notation))
+            validMoves, selected = gs.getValid(), ()
+            status = ui.gameStatus(gs)
+        renderer.draw(gs, validMoves, selected, None, status)
+        frames.append(time.perf_counter() - start)
+    return frames
+
+
+def report(name, frames, cpu, sessionSeconds):
+    ordered = sorted(frames)
+    print("%-13s %6d frames  mean %6.2f ms  p95 %6.2f ms  cpu %7.3fs for %4.0fs of play (%.1f%% of a core)" % (
+        name, len(frames), statistics.mean(frames) * 1000, ordered[int(0.95 * (len(ordered) - 1))] * 1000, cpu,
+        sessionSeconds, 100 * cpu / sessionSeconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare full-frame and dirty-square rendering")
+    parser.add_argument('--think', type=float, default=5.0, help="seconds between moves in the scripted session")
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))  # loadimages reads images/ relative to here
+    p.init()
+    screen = p.display.set_mode((ui.width, ui.height))
+    ui.loadimages()
+    sessionSeconds = len(session) * (args.think + 0.5)
+    for name, run in (('every frame', everyFrame), ('event driven', eventDriven)):
+        cpu = time.process_time()
+        frames = run(screen, args.think)
+        report(name, frames, time.process_time() - cpu, sessionSeconds)
+    p.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import asyncio
+import math
+import sys
+from collections import deque
+
+import analysis
+
+# Whole-game analysis: an eval and best move for every ply plus inaccuracy/mistake/blunder judgements for the moves
+# actually played. The positions of the game go to the Stockfish pool in small batches (StockfishPool.analyseBatch,
+# one warm engine per batch) with several batches in flight, and reports come out in ply order as soon as the
+# position before and after a move are both done, so a UI can show the opening while the endgame is still running.
+#
+# Scores are centipawns from white's point of view. A move is judged by how much it lowers the mover's winning
+# chances, 2 / (1 + exp(-0.004 * cp)) - 1 in [-1, 1] with mates counting as +-1, against the thresholds below.
+
+thresholds = (('blunder', 0.3), ('mistake', 0.2), ('inaccuracy', 0.1))
+
+
+def winningChances(centipawns, mate):
+    if mate is not None:
+        return 1.0 if mate > 0 else -1.0
+    if centipawns is None:
+        return 0.0
+    return 2 / (1 + math.exp(-0.004 * centipawns)) - 1
+
+
+def judge(loss):
+    for name, threshold in thresholds:
+        if loss >= threshold:
+            return name
+    return None
+
+
+def gamePositions(gs):
+    # (fens, notations, finished): the FEN before every move of gs.moves plus the final one, the moves in coordinate
+    # notation, and for positions without legal moves the result to use instead of asking the engine
+    # ({index: {'centipawns', 'mate'}}). gs is taken back to its first position and replayed, ending where it was.
+    played = list(gs.moves)
+    for _ in played:
+        gs.undoMove()
+    fens, notations, finished = [], [], {}
+    try:
+        for move in played + [None]:
+            fens.append(gs.getFEN())
+            if not gs.getValid():
+                # checkmate scores as a mate for the side that delivered it, stalemate as a dead draw
+                winner = 0 if not gs.inCheck else (-1 if gs.whiteMove else 1)
+                finished[len(fens) - 1] = {'centipawns': None if winner else 0, 'mate': winner or None}
+            if move is not None:
+                notations.append(move.getNotation())
+                gs.makeMove(move)
+    finally:
+        for move in played[len(notations):]:
+            gs.makeMove(move)
+    return fens, notations, finished
+
+
+class GameAnalysis:
+    # the request bookkeeping shared by the sync and async generators
+    def __init__(self, gs, pool=None, depth=None, movetime=None, budget=None, batchSize=4, window=None):
+        # depth or movetime (seconds per position) set the effort per ply; budget (seconds) spreads a total time
+        # over the positions of the game instead. window is how many batches are in flight (two per engine by default)
+        self.pool = pool or analysis.defaultPool()
+        self.fens, self.notations, self.finished = gamePositions(gs)
+        self.depth = depth
+        self.movetime = movetime
+        if budget is not None:
+            self.movetime = budget / max(1, len(self.fens) - len(self.finished))
+        self.window = window or 2 * self.pool.size
+        self.results = [self.finished.get(i) for i in range(len(self.fens))]
+        indexes = [i for i in range(len(self.fens)) if i not in self.finished]
+        self.batches = deque(indexes[i:i + batchSize] for i in range(0, len(indexes), batchSize))
+        self.pending = deque()  # (indexes, Future), oldest first
+
+    def fill(self):
+        while self.batches and len(self.pending) < self.window:
+            indexes = self.batches.popleft()
+            future = self.pool.analyseBatch([self.fens[i] for i in indexes], self.depth, self.movetime)
+            self.pending.append((indexes, future))
+
+    def store(self, indexes, results):
+        for i, result in zip(indexes, results):
+            self.results[i] = result
+
+    def report(self, ply):
+        before, after = self.results[ply], self.results[ply + 1]
+        sign = 1 if self.fens[ply].split()[1] == 'w' else -1
+        loss = max(0.0, sign * (winningChances(before.get('centipawns'), before.get('mate')) -
+                                winningChances(after.get('centipawns'), after.get('mate'))))
+        return {'ply': ply, 'fen': self.fens[ply], 'move': self.notations[ply], 'bestmove': before.get('bestmove'),
+                'centipawns': before.get('centipawns'), 'mate': before.get('mate'),
+                'centipawnsAfter': after.get('centipawns'), 'mateAfter': after.get('mate'),
+                'loss': round(loss, 4), 'judgement': judge(loss)}
+
+
+def analyseGame(gs, pool=None, depth=None, movetime=None, budget=None, batchSize=4, window=None):
+    # yields one report per move of gs.moves, in order (see GameAnalysis.report for the fields)
+    game = GameAnalysis(gs, pool, depth, movetime, budget, batchSize, window)
+    game.fill()
+    for ply in range(len(game.notations)):
+        while game.results[ply + 1] is None:
+            indexes, future = game.pending.popleft()
+            game.store(indexes, future.result())
+            game.fill()
+        yield game.report(ply)
+
+
+async def analyseGameAsync(gs, pool=None, depth=None, movetime=None, budget=None, batchSize=4, window=None):
+    # analyseGame as an async generator, the event loop keeps running while the engines work
+    game = GameAnalysis(gs, pool, depth, movetime, budget, batchSize, window)
+    game.fill()
+    for ply in range(len(game.notations)):
+        while game.results[ply + 1] is None:
+            indexes, future = game.pending.popleft()
+            game.store(indexes, await asyncio.wrap_future(future))
+            game.fill()
+        yield game.report(ply)
+
+
+def summary(reports):
+    # per side: move count, average winning-chance loss and how many moves got each judgement
+    sides = {'w': {'moves': 0, 'loss': 0.0}, 'b': {'moves': 0, 'loss': 0.0}}
+    for report in reports:
+        side = sides[report['fen'].split()[1]]
+        side['moves'] += 1
+        side['loss'] += report['loss']
+        if report['judgement']:
+            side[report['judgement']] = side.get(report['judgement'], 0) + 1
+    for side in sides.values():
+        side['averageLoss'] = round(side.pop('loss') / side['moves'], 4) if side['moves'] else 0.0
+    return sides
+
+
+def moveLabel(fen):
+    # '12.' or '12...' for the move played from fen, taken from its fullmove number and side to move so games that
+    # start from a FEN are numbered from there
+    fields = fen.split()
+    return '%d%s' % (int(fields[5]) if len(fields) > 5 else 1, '.' if fields[1] == 'w' else '...')
+
+
+def main():
+    import pgn
+    parser = argparse.ArgumentParser(description="Analyse every move of the games in a PGN file")
+    parser.add_argument('pgn')
+    parser.add_argument('--depth', type=int, help="search depth per position (default %d)" % analysis.DEFAULT_DEPTH)
+    parser.add_argument('--movetime', type=float, help="seconds per position instead of a fixed depth")
+    parser.add_argument('--budget', type=float, help="seconds per game, spread over its positions")
+    parser.add_argument('--games', type=int, help="stop after this many games")
+    args = parser.parse_args()
+
+    for index, (headers, movetext) in enumerate(pgn.readGames(args.pgn)):
+        if args.games is not None and index >= args.games:
+            break
+        gs = None
+        try:
+            for gs, move, san in pgn.replay(headers, movetext):
+                pass
+        except pgn.PGNError as e:
+            print("game %d: stopped at ply %d: %s" % (index + 1, e.ply + 1, e), file=sys.stderr)
+        if gs is None:
+            continue
+        print("[%s - %s %s]" % (headers.get('White', '?'), headers.get('Black', '?'), headers.get('Result', '*')))
+        reports = []
+        for report in analyseGame(gs, depth=args.depth, movetime=args.movetime, budget=args.budget):
+            reports.append(report)
+            score = '#%d' % report['mate'] if report['mate'] is not None else '%+d' % (report['centipawns'] or 0)
+            print("%6s %-6s %6s  best %-6s %s" % (moveLabel(report['fen']), report['move'], score,
+                                                 report['bestmove'] or '-', report['judgement'] or ''))
+        for color, side in summary(reports).items():
+            print("%s: %s" % ('white' if color == 'w' else 'black', side))
+
+
+if __name__ == "__main__":
+    main()
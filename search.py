@@ -0,0 +1,326 @@
+import time
+
+# Built-in engine: negamax alpha-beta with iterative deepening, a transposition table, quiescence search and
+# MVV-LVA/killer/history move ordering. It only needs getValid/makeMove/undoMove and the Zobrist hash, so it works
+# with either backend and doesn't need the Stockfish binary.
+
+MATE = 100000
+BITBASE_WIN = MATE - 2000  # a bitbase win without a distance to mate, below the mate scores toTT adjusts
+INFINITY = 1000000
+pieceValues = {'p': 100, 'n': 320, 'b': 330, 'r': 500, 'q': 900, 'k': 0}
+
+# piece-square tables from white's point of view, indexed [row][col] like GameState.board (row 0 is rank 8)
+pieceSquareTables = {
+    'p': [[0, 0, 0, 0, 0, 0, 0, 0],
+          [50, 50, 50, 50, 50, 50, 50, 50],
+          [10, 10, 20, 30, 30, 20, 10, 10],
+          [5, 5, 10, 25, 25, 10, 5, 5],
+          [0, 0, 0, 20, 20, 0, 0, 0],
+          [5, -5, -10, 0, 0, -10, -5, 5],
+          [5, 10, 10, -20, -20, 10, 10, 5],
+          [0, 0, 0, 0, 0, 0, 0, 0]],
+    'n': [[-50, -40, -30, -30, -30, -30, -40, -50],
+          [-40, -20, 0, 0, 0, 0, -20, -40],
+          [-30, 0, 10, 15, 15, 10, 0, -30],
+          [-30, 5, 15, 20, 20, 15, 5, -30],
+          [-30, 0, 15, 20, 20, 15, 0, -30],
+          [-30, 5, 10, 15, 15, 10, 5, -30],
+          [-40, -20, 0, 5, 5, 0, -20, -40],
+          [-50, -40, -30, -30, -30, -30, -40, -50]],
+    'b': [[-20, -10, -10, -10, -10, -10, -10, -20],
+          [-10, 0, 0, 0, 0, 0, 0, -10],
+          [-10, 0, 5, 10, 10, 5, 0, -10],
+          [-10, 5, 5, 10, 10, 5, 5, -10],
+          [-10, 0, 10, 10, 10, 10, 0, -10],
+          [-10, 10, 10, 10, 10, 10, 10, -10],
+          [-10, 5, 0, 0, 0, 0, 5, -10],
+          [-20, -10, -10, -10, -10, -10, -10, -20]],
+    'r': [[0, 0, 0, 0, 0, 0, 0, 0],
+          [5, 10, 10, 10, 10, 10, 10, 5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [0, 0, 0, 5, 5, 0, 0, 0]],
+    'q': [[-20, -10, -10, -5, -5, -10, -10, -20],
+          [-10, 0, 0, 0, 0, 0, 0, -10],
+          [-10, 0, 5, 5, 5, 5, 0, -10],
+          [-5, 0, 5, 5, 5, 5, 0, -5],
+          [0, 0, 5, 5, 5, 5, 0, -5],
+          [-10, 5, 5, 5, 5, 5, 0, -10],
+          [-10, 0, 5, 0, 0, 0, 0, -10],
+          [-20, -10, -10, -5, -5, -10, -10, -20]],
+    'k': [[-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-20, -30, -30, -40, -40, -30, -30, -20],
+          [-10, -20, -20, -20, -20, -20, -20, -10],
+          [20, 20, 0, 0, 0, 0, 20, 20],
+          [20, 30, 10, 0, 0, 10, 30, 20]],
+}
+
+# transposition table entry flags
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class SearchStopped(Exception):
+    pass
+
+
+def evaluate(gs):
+    # material + piece-square score from the side to move's point of view
+    score = 0
+    for r, row in enumerate(gs.boardRows()):
+        for c, piece in enumerate(row):
+            if piece != '--':
+                kind = piece[1]
+                if piece[0] == 'w':
+                    score += pieceValues[kind] + pieceSquareTables[kind][r][c]
+                else:
+                    score -= pieceValues[kind] + pieceSquareTables[kind][7 - r][c]
+    return score if gs.whiteMove else -score
+
+
+class TranspositionTable:
+    # Fixed number of slots indexed by hash, so memory stays bounded no matter how long we search.
+    # A slot is replaced when the new entry is at least as deep or the old one is left over from an earlier search.
+    def __init__(self, size=1 << 18):
+        self.size = size
+        self.slots = [None] * size
+        self.generation = 0
+
+    def newSearch(self):
+        self.generation += 1
+
+    def probe(self, key):
+        entry = self.slots[key % self.size]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, score, flag, moveID):
+        index = key % self.size
+        entry = self.slots[index]
+        if entry is None or entry[5] != self.generation or depth >= entry[1] or entry[0] == key:
+            self.slots[index] = (key, depth, score, flag, moveID, self.generation)
+
+    def clear(self):
+        self.slots = [None] * self.size
+
+
+class Searcher:
+    def __init__(self, ttSize=1 << 18, useBitbases=True):
+        import bitbases
+        self.tt = TranspositionTable(ttSize)
+        self.bitbases = bitbases.defaultBitbases() if useBitbases else None
+        self.maxBitbasePieces = bitbases.MAX_PIECES
+        self.nodes = 0
+        self.iterations = []  # (depth, score, nodes, seconds, best move notation) per finished iteration
+
+    def search(self, gs, depth=64, movetime=None, nodes=None):
+        # iterative deepening until depth, movetime (seconds) or the node budget runs out.
+        # Returns the best move of the deepest finished iteration and its score for the side to move.
+        self.tt.newSearch()
+        self.nodes = 0
+        self.nodeLimit = nodes
+        self.deadline = time.perf_counter() + movetime if movetime is not None else None
+        self.killers = [[None, None] for _ in range(128)]
+        self.history = {}
+        self.iterations = []
+        start = time.perf_counter()
+
+        movesMade = len(gs.moves)
+        bestMove, bestScore = None, 0
+        try:
+            rootMoves = gs.getValid()
+            if not rootMoves:
+                return None, -MATE if gs.inCheck else 0
+            bestMove = rootMoves[0]
+            for d in range(1, depth + 1):
+                score = self.negamax(gs, d, -INFINITY, INFINITY, 0)
+                entry = self.tt.probe(gs.zobristHash)
+                move = self.findMove(rootMoves, entry[4]) if entry else None
+                if move is not None:
+                    bestMove, bestScore = move, score
+                self.iterations.append((d, score, self.nodes, time.perf_counter() - start, bestMove.getNotation()))
+                if abs(score) >= MATE - 128:
+                    break
+        except SearchStopped:
+            while len(gs.moves) > movesMade:
+                gs.undoMove()
+        return bestMove, bestScore
+
+    def checkBudget(self):
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            raise SearchStopped()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchStopped()
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkBudget()
+        # a position seen before on this line (or in the game) is a draw by repetition if either side wants it
+        if ply > 0 and (gs.isRepetition(2) or gs.isFiftyMoveDraw()):
+            return 0
+        # the piece count is kept on the state, so most nodes skip the probe without looking at the board
+        if ply > 0 and self.bitbases is not None and gs.pieceCount <= self.maxBitbasePieces:
+            solved = self.bitbases.probe(gs)
+            if solved is not None:
+                return bitbaseScore(solved, ply)
+        if depth <= 0:
+            return self.quiescence(gs, alpha, beta, ply)
+
+        key = gs.zobristHash
+        ttMoveID = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            ttMoveID = entry[4]
+            if ply > 0 and entry[1] >= depth:
+                score = fromTT(entry[2], ply)
+                if entry[3] == EXACT:
+                    return score
+                if entry[3] == LOWER and score >= beta:
+                    return score
+                if entry[3] == UPPER and score <= alpha:
+                    return score
+
+        moves = gs.getValid()
+        if not moves:
+            return -MATE + ply if gs.inCheck else 0
+
+        originalAlpha = alpha
+        bestScore, bestMoveID = -INFINITY, None
+        for move in self.orderMoves(moves, ttMoveID, ply):
+            gs.makeMove(move)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score > bestScore:
+                bestScore, bestMoveID = score, move.moveID
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if move.pieceCaptured == '--':
+                            self.rememberQuietCutoff(move, depth, ply)
+                        break
+
+        if bestScore <= originalAlpha:
+            flag = UPPER
+        elif bestScore >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.tt.store(key, depth, toTT(bestScore, ply), flag, bestMoveID)
+        return bestScore
+
+    def quiescence(self, gs, alpha, beta, ply):
+        # only captures and promotions from here on (all moves when in check) so we never stop mid-exchange
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkBudget()
+        moves = gs.getValid()
+        if not moves:
+            return -MATE + ply if gs.inCheck else 0
+        if not gs.inCheck:
+            standPat = evaluate(gs)
+            if standPat >= beta:
+                return standPat
+            alpha = max(alpha, standPat)
+            moves = [m for m in moves if m.pieceCaptured != '--' or m.pawnPromotion]
+        for move in self.orderMoves(moves, None, ply):
+            gs.makeMove(move)
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+    def orderMoves(self, moves, ttMoveID, ply):
+        killers = self.killers[ply] if ply < len(self.killers) else (None, None)
+
+        def priority(move):
+            if move.moveID == ttMoveID:
+                return 10000000
+            if move.pieceCaptured != '--':
+                # MVV-LVA: most valuable victim first, cheapest attacker breaks ties
+                return 1000000 + pieceValues[move.pieceCaptured[1]] * 10 - pieceValues[move.pieceMoved[1]] // 10
+            if move.pawnPromotion:
+                return 900000 + pieceValues[move.promotionPiece]
+            if move.moveID == killers[0]:
+                return 800000
+            if move.moveID == killers[1]:
+                return 700000
+            return self.history.get((move.pieceMoved, move.endRow * 8 + move.endCol), 0)
+        return sorted(moves, key=priority, reverse=True)
+
+    def rememberQuietCutoff(self, move, depth, ply):
+        if ply < len(self.killers) and self.killers[ply][0] != move.moveID:
+            self.killers[ply][1] = self.killers[ply][0]
+            self.killers[ply][0] = move.moveID
+        key = (move.pieceMoved, move.endRow * 8 + move.endCol)
+        self.history[key] = min(self.history.get(key, 0) + depth * depth, 600000)
+
+    def findMove(self, moves, moveID):
+        for move in moves:
+            if move.moveID == moveID:
+                return move
+        return None
+
+    def principalVariation(self, gs, maxLength=32):
+        # follows best moves through the transposition table from the current position
+        pv = []
+        seen = set()
+        while len(pv) < maxLength and gs.zobristHash not in seen:
+            seen.add(gs.zobristHash)
+            entry = self.tt.probe(gs.zobristHash)
+            move = self.findMove(gs.getValid(), entry[4]) if entry else None
+            if move is None:
+                break
+            pv.append(move)
+            gs.makeMove(move)
+        for _ in pv:
+            gs.undoMove()
+        return pv
+
+
+def bitbaseScore(solved, ply):
+    # (wdl, plies to mate) from bitbases.probe as a score for the side to move, mates counted from the root
+    wdl, plies = solved
+    if wdl == 0:
+        return 0
+    return wdl * (BITBASE_WIN - ply if plies is None else MATE - ply - plies)
+
+
+# mate scores are stored relative to the node so they stay correct when the position is reached at another ply
+def toTT(score, ply):
+    if score >= MATE - 1000:
+        return score + ply
+    if score <= -MATE + 1000:
+        return score - ply
+    return score
+
+
+def fromTT(score, ply):
+    if score >= MATE - 1000:
+        return score - ply
+    if score <= -MATE + 1000:
+        return score + ply
+    return score
+
+
+def get_best_move(gs, depth=64, movetime=1.0, nodes=None, useBook=True):
+    if useBook:
+        import polyglot
+        bookMove = polyglot.bookMove(gs)
+        if bookMove is not None:
+            return bookMove
+    searcher = Searcher()
+    if searcher.bitbases is not None:
+        move = searcher.bitbases.bestMove(gs)
+        if move is not None:
+            return move.getNotation()
+    move, _ = searcher.search(gs, depth, movetime, nodes)
+    return move.getNotation() if move is not None else None
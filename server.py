@@ -0,0 +1,607 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import signal
+import struct
+import sys
+import time
+import uuid
+from array import array
+from collections import OrderedDict, defaultdict, deque
+from urllib.parse import urlsplit
+
+import movecode
+from bitboard import BitboardGameState, squareOf
+from engine import START_FEN
+
+# Multi-game service over HTTP and WebSocket, asyncio and the standard library only.
+# A game is kept as its starting FEN plus the packed 16-bit codes of the moves played (movecode.py), a few bytes per
+# ply. Full BitboardGameState positions exist only for the most recently used games (an LRU of maxLive), any other
+# game is rebuilt by replaying its moves when a request comes in. Games idle for idleSeconds are written to
+# directory and dropped from memory, and read back on their next request.
+#
+#   POST /games {"fen": ...}        new game (fen optional)
+#   GET  /games/<id>                position, moves played and status
+#   GET  /games/<id>/legal          legal moves in coordinate notation
+#   POST /games/<id>/move {"move"}  play a move, e.g. "e2e4" or "e7e8n"
+#   GET  /stats                     session counts and latency percentiles
+#   GET  /ws                        WebSocket, JSON messages {"op": new|state|legal|move|stats, "id", "move", "fen",
+#                                   "ref"}, every reply carries the same op and ref
+
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions')
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+MAX_MESSAGE = 1 << 16
+BACK_RANKS = 0xFF | 0xFF << 56  # rows 0 and 7, ranks 8 and 1
+idPattern = re.compile(r'^[0-9a-f]{32}$')
+httpReasons = {101: 'Switching Protocols', 200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class ServiceError(Exception):
+    status = 400
+
+
+class GameNotFound(ServiceError):
+    status = 404
+
+
+class IllegalMove(ServiceError):
+    pass
+
+
+def unplayable(gs):
+    # why a parsed position can't be played, None when it can
+    pieces = gs.pieces
+    if bin(pieces['wk']).count('1') != 1 or bin(pieces['bk']).count('1') != 1:
+        return "each side needs exactly one king"
+    if (pieces['wp'] | pieces['bp']) & BACK_RANKS:
+        return "pawns can't stand on the first or eighth rank"
+    waiting = 'b' if gs.whiteMove else 'w'
+    if gs.attackersTo(squareOf(pieces[waiting + 'k']), 'w' if gs.whiteMove else 'b', gs.occupancy):
+        return "the side not to move is in check"
+    return None
+
+
+class Session:
+    __slots__ = ('startFEN', 'moves', 'lastUsed')
+
+    def __init__(self, startFEN, moves=None):
+        self.startFEN = startFEN
+        self.moves = moves if moves is not None else array('H')
+        self.lastUsed = time.monotonic()
+
+
+class GameStore:
+    def __init__(self, directory=DEFAULT_DIRECTORY, maxLive=1024, idleSeconds=300.0):
+        self.directory = directory
+        self.maxLive = maxLive
+        self.idleSeconds = idleSeconds
+        self.sessions = {}  # id -> Session, every game held in memory
+        self.live = OrderedDict()  # id -> BitboardGameState, least recently used first
+        self.buffer = movecode.newMoveList()  # requests are handled one at a time on the event loop
+        self.counters = {'created': 0, 'evicted': 0, 'loaded': 0, 'replayed': 0}
+
+    def path(self, gameId):
+        return os.path.join(self.directory, gameId + '.game')
+
+    def create(self, fen=START_FEN):
+        try:
+            gs = BitboardGameState(fen)
+        except (ValueError, KeyError, IndexError) as e:
+            raise ServiceError("bad FEN %r: %s" % (fen, e)) from None
+        problem = unplayable(gs)
+        if problem:
+            raise ServiceError("bad FEN %r: %s" % (fen, problem))
+        gameId = uuid.uuid4().hex
+        result = self.describe(gameId, gs)
+        # registered only once the position has been described, so a FEN that fails never leaves a game behind.
+        # The start position string is shared by every game that starts from it
+        self.sessions[gameId] = Session(START_FEN if fen == START_FEN else fen)
+        self.remember(gameId, gs)
+        self.counters['created'] += 1
+        return result
+
+    def session(self, gameId):
+        session = self.sessions.get(gameId)
+        if session is None:
+            if not isinstance(gameId, str) or not idPattern.match(gameId):
+                raise GameNotFound("no game %r" % (gameId,))
+            try:
+                with open(self.path(gameId), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                raise GameNotFound("no game %r" % gameId) from None
+            fen, codes = data.split(b'\n', 1)
+            moves = array('H')
+            moves.frombytes(codes)
+            if sys.byteorder != 'little':
+                moves.byteswap()
+            fen = fen.decode()
+            session = self.sessions[gameId] = Session(START_FEN if fen == START_FEN else fen, moves)
+            os.remove(self.path(gameId))
+            self.counters['loaded'] += 1
+        session.lastUsed = time.monotonic()
+        return session
+
+    def position(self, gameId):
+        session = self.session(gameId)
+        gs = self.live.get(gameId)
+        if gs is not None:
+            self.live.move_to_end(gameId)
+            return gs
+        gs = BitboardGameState(session.startFEN)
+        for code in session.moves:
+            gs.makeMove(code)
+        self.counters['replayed'] += 1
+        self.remember(gameId, gs)
+        return gs
+
+    def remember(self, gameId, gs):
+        self.live[gameId] = gs
+        if len(self.live) > self.maxLive:
+            self.live.popitem(last=False)
+
+    def status(self, gs, count):
+        if count == 0:
+            return 'checkmate' if gs.inCheck else 'stalemate'
+        if gs.isRepetition():
+            return 'threefold repetition'
+        if gs.isFiftyMoveDraw():
+            return 'fifty-move rule'
+        if gs.isInsufficientMaterial():
+            return 'insufficient material'
+        return 'ongoing'
+
+    def describe(self, gameId, gs, count=None):
+        if count is None:
+            count = gs.generateMoves(self.buffer)
+        return {'id': gameId, 'fen': gs.getFEN(), 'turn': 'w' if gs.whiteMove else 'b',
+                'status': self.status(gs, count)}
+
+    def state(self, gameId):
+        gs = self.position(gameId)
+        result = self.describe(gameId, gs)
+        result['moves'] = [movecode.notation(code) for code in self.sessions[gameId].moves]
+        return result
+
+    def legalMoves(self, gameId):
+        gs = self.position(gameId)
+        buffer = self.buffer
+        count = gs.generateMoves(buffer)
+        return {'id': gameId, 'moves': [movecode.notation(buffer[i]) for i in range(count)],
+                'status': self.status(gs, count)}
+
+    def move(self, gameId, notation):
+        gs = self.position(gameId)
+        buffer = self.buffer
+        count = gs.generateMoves(buffer)
+        if self.status(gs, count) != 'ongoing':
+            raise IllegalMove("game %s is over" % gameId)
+        for i in range(count):
+            code = buffer[i]
+            if movecode.notation(code) == notation:
+                gs.makeMove(code)
+                self.sessions[gameId].moves.append(code)
+                result = self.describe(gameId, gs)
+                result['move'] = notation
+                return result
+        raise IllegalMove("%r is not legal in %s" % (notation, gs.getFEN()))
+
+    def save(self, gameId):
+        session = self.sessions.pop(gameId)
+        self.live.pop(gameId, None)
+        moves = session.moves
+        if sys.byteorder != 'little':
+            moves = array('H', moves)
+            moves.byteswap()
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self.path(gameId) + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(session.startFEN.encode() + b'\n' + moves.tobytes())
+        os.replace(temporary, self.path(gameId))
+        self.counters['evicted'] += 1
+
+    def idle(self, now=None):
+        # ids of the games nobody has touched for idleSeconds
+        cutoff = (time.monotonic() if now is None else now) - self.idleSeconds
+        return [gameId for gameId, session in self.sessions.items() if session.lastUsed < cutoff]
+
+    def close(self):
+        # writes every game to disk so a restarted server picks them up again
+        for gameId in list(self.sessions):
+            self.save(gameId)
+
+    def stats(self):
+        return dict(self.counters, inMemory=len(self.sessions), live=len(self.live))
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0}
+
+    def at(p):
+        return round(ordered[int(round(p / 100 * (len(ordered) - 1)))] * 1000, 3)
+    return {'count': len(ordered), 'p50ms': at(50), 'p95ms': at(95), 'p99ms': at(99), 'maxms': at(100)}
+
+
+def unmask(data, mask):
+    # XOR with the repeating 4-byte client mask, done on one big integer instead of byte by byte
+    length = len(data)
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(key, 'big')).to_bytes(length, 'big')
+
+
+async def readFrame(reader):
+    # one WebSocket frame: (final, opcode, payload)
+    first, second = await reader.readexactly(2)
+    length = second & 0x7f
+    if length == 126:
+        length = struct.unpack('>H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('>Q', await reader.readexactly(8))[0]
+    if length > MAX_MESSAGE:
+        raise ServiceError("frame of %d bytes is too big" % length)
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    data = await reader.readexactly(length)
+    if mask is not None and data:
+        data = unmask(data, mask)
+    return first & 0x80, first & 0x0f, data
+
+
+def writeFrame(writer, opcode, data, masked=False):
+    # clients have to mask what they send, servers must not
+    length = len(data)
+    maskBit = 0x80 if masked else 0
+    if length < 126:
+        header = struct.pack('>BB', 0x80 | opcode, maskBit | length)
+    elif length < 1 << 16:
+        header = struct.pack('>BBH', 0x80 | opcode, maskBit | 126, length)
+    else:
+        header = struct.pack('>BBQ', 0x80 | opcode, maskBit | 127, length)
+    if masked:
+        mask = os.urandom(4)
+        header += mask
+        data = unmask(data, mask) if data else data
+    writer.write(header + data)
+
+
+async def readHead(reader):
+    # request or status line plus lower-cased headers, None when the peer closed the connection
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    lines = head.decode('latin-1').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return lines[0], headers
+
+
+class GameServer:
+    def __init__(self, store, latencySamples=10000):
+        self.store = store
+        self.latencies = defaultdict(lambda: deque(maxlen=latencySamples))  # op -> recent handling times
+        self.connections = 0
+
+    def call(self, op, params):
+        # every request from either protocol ends up here
+        start = time.perf_counter()
+        store = self.store
+        if op == 'new':
+            result = store.create(params.get('fen') or START_FEN)
+        elif op == 'state':
+            result = store.state(params.get('id'))
+        elif op == 'legal':
+            result = store.legalMoves(params.get('id'))
+        elif op == 'move':
+            result = store.move(params.get('id'), params.get('move'))
+        elif op == 'stats':
+            result = self.stats()
+        else:
+            raise ServiceError("unknown op %r" % (op,))
+        self.latencies[op].append(time.perf_counter() - start)
+        return result
+
+    def stats(self):
+        return {'sessions': self.store.stats(), 'connections': self.connections,
+                'latency': {op: percentiles(samples) for op, samples in self.latencies.items()}}
+
+    def route(self, method, path):
+        # (op, game id) for an HTTP request
+        parts = [part for part in path.split('/') if part]
+        if parts == ['games'] and method == 'POST':
+            return 'new', None
+        if parts == ['stats'] and method == 'GET':
+            return 'stats', None
+        if len(parts) == 2 and parts[0] == 'games' and method == 'GET':
+            return 'state', parts[1]
+        if len(parts) == 3 and parts[0] == 'games':
+            if parts[2] == 'legal' and method == 'GET':
+                return 'legal', parts[1]
+            if parts[2] == 'move' and method == 'POST':
+                return 'move', parts[1]
+        raise GameNotFound("no route for %s %s" % (method, path))
+
+    def respond(self, op, params):
+        # (HTTP status, JSON-able reply)
+        try:
+            return (201 if op == 'new' else 200), self.call(op, params)
+        except ServiceError as e:
+            return e.status, {'error': str(e)}
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request = await readHead(reader)
+                if request is None:
+                    break
+                line, headers = request
+                try:
+                    method, target, version = line.split(' ', 2)
+                except ValueError:
+                    break
+                if headers.get('upgrade', '').lower() == 'websocket':
+                    await self.websocket(reader, writer, headers)
+                    break
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_MESSAGE:
+                    status, reply = 413, {'error': "body too big"}
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    try:
+                        params = json.loads(body) if body else {}
+                        op, gameId = self.route(method, urlsplit(target).path)
+                        if gameId is not None:
+                            params['id'] = gameId
+                        status, reply = self.respond(op, params)
+                    except ServiceError as e:
+                        status, reply = e.status, {'error': str(e)}
+                    except (ValueError, TypeError, AttributeError) as e:
+                        status, reply = 400, {'error': "bad request: %s" % e}
+                keepAlive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                data = json.dumps(reply).encode()
+                writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n%s\r\n" % (
+                    status, httpReasons.get(status, ''), len(data), '' if keepAlive else 'Connection: close\r\n')
+                              ).encode() + data)
+                await writer.drain()
+                if not keepAlive or length > MAX_MESSAGE:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def websocket(self, reader, writer, headers):
+        key = headers.get('sec-websocket-key', '')
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      "Sec-WebSocket-Accept: %s\r\n\r\n" % accept).encode())
+        await writer.drain()
+        fragments = []
+        while True:
+            try:
+                final, opcode, data = await readFrame(reader)
+            except ServiceError:
+                writeFrame(writer, 8, struct.pack('>H', 1009))
+                break
+            if opcode == 8:
+                writeFrame(writer, 8, data[:2])
+                break
+            if opcode == 9:
+                writeFrame(writer, 10, data)
+                continue
+            if opcode not in (0, 1, 2):
+                continue
+            fragments.append(data)
+            if not final:
+                continue
+            message, fragments = b''.join(fragments), []
+            try:
+                params = json.loads(message)
+                op = params.get('op')
+                status, reply = self.respond(op, params)
+            except (ValueError, TypeError, AttributeError) as e:
+                op, params, status, reply = None, {}, 400, {'error': "bad message: %s" % e}
+            reply['op'] = op
+            if 'ref' in params:
+                reply['ref'] = params['ref']
+            if status >= 400:
+                reply['status'] = status
+            writeFrame(writer, 1, json.dumps(reply).encode())
+            await writer.drain()
+        await writer.drain()
+
+    async def evictIdle(self):
+        # moves idle games to disk a batch at a time so the event loop keeps answering in between
+        while True:
+            await asyncio.sleep(max(1.0, self.store.idleSeconds / 4))
+            for i, gameId in enumerate(self.store.idle()):
+                if gameId in self.store.sessions:
+                    self.store.save(gameId)
+                if i % 64 == 63:
+                    await asyncio.sleep(0)
+
+
+async def serve(host, port, store):
+    server = GameServer(store)
+    listener = await asyncio.start_server(server.handle, host, port)
+    evictor = asyncio.create_task(server.evictIdle())
+    # SIGINT/SIGTERM stop the server cleanly, saving every game (add_signal_handler isn't available on Windows)
+    stop = asyncio.Event()
+    for signalNumber in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signalNumber, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    print("serving on http://%s:%d (games saved to %s)" % (host, port, store.directory), flush=True)
+    try:
+        async with listener:
+            await stop.wait()
+    finally:
+        evictor.cancel()
+        store.close()
+
+
+# load test: many clients, each playing several games at once with random legal moves
+
+
+class WebSocketClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write(("GET /ws HTTP/1.1\r\nHost: %s:%d\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      "Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n\r\n" % (host, port, key)).encode())
+        await writer.drain()
+        response = await readHead(reader)
+        if response is None or response[0].split()[1] != '101':
+            raise ConnectionError("websocket upgrade refused: %r" % (response,))
+        return cls(reader, writer)
+
+    async def request(self, op, **params):
+        params['op'] = op
+        writeFrame(self.writer, 1, json.dumps(params).encode(), masked=True)
+        await self.writer.drain()
+        while True:
+            final, opcode, data = await readFrame(self.reader)
+            if opcode == 1:
+                return json.loads(data)
+            if opcode == 8:
+                raise ConnectionError("server closed the websocket")
+
+    async def close(self):
+        writeFrame(self.writer, 8, struct.pack('>H', 1000), masked=True)
+        await self.writer.drain()
+        self.writer.close()
+
+
+class HTTPClient:
+    routes = {'new': ('POST', '/games'), 'state': ('GET', '/games/%s'), 'legal': ('GET', '/games/%s/legal'),
+              'move': ('POST', '/games/%s/move'), 'stats': ('GET', '/stats')}
+
+    def __init__(self, reader, writer, host):
+        self.reader = reader
+        self.writer = writer
+        self.host = host
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer, '%s:%d' % (host, port))
+
+    async def request(self, op, **params):
+        method, path = self.routes[op]
+        if '%s' in path:
+            path = path % params.pop('id')
+        body = json.dumps(params).encode() if method == 'POST' else b''
+        self.writer.write(("%s %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n"
+                           % (method, path, self.host, len(body))).encode() + body)
+        await self.writer.drain()
+        response = await readHead(self.reader)
+        if response is None:
+            raise ConnectionError("server closed the connection")
+        reply = json.loads(await self.reader.readexactly(int(response[1].get('content-length') or 0)))
+        status = int(response[0].split()[1])
+        if status >= 400:
+            reply['status'] = status
+        return reply
+
+    async def close(self):
+        self.writer.close()
+
+
+async def playGames(client, games, plies, latencies, rng):
+    # creates `games` games on one connection and plays them in turns, a legal-moves then a move request per ply
+    async def timed(op, **params):
+        start = time.perf_counter()
+        reply = await client.request(op, **params)
+        latencies[op].append(time.perf_counter() - start)
+        if 'error' in reply:
+            latencies['errors'].append(0.0)
+        return reply
+
+    active = [(await timed('new'))['id'] for _ in range(games)]
+    for _ in range(plies):
+        stillPlaying = []
+        for gameId in active:
+            legal = await timed('legal', id=gameId)
+            if legal.get('status') != 'ongoing':
+                continue
+            await timed('move', id=gameId, move=rng.choice(legal['moves']))
+            stillPlaying.append(gameId)
+        active = stillPlaying
+        if not active:
+            break
+    for gameId in active:
+        await timed('state', id=gameId)
+
+
+async def loadTest(host, port, clients, games, plies, useHTTP, seed):
+    latencies = defaultdict(list)
+    connectionClass = HTTPClient if useHTTP else WebSocketClient
+    connections = [await connectionClass.connect(host, port) for _ in range(clients)]
+    perClient = [games // clients + (i < games % clients) for i in range(clients)]
+    start = time.perf_counter()
+    await asyncio.gather(*[playGames(client, n, plies, latencies, random.Random(seed + i))
+                           for i, (client, n) in enumerate(zip(connections, perClient))])
+    seconds = time.perf_counter() - start
+    serverStats = await connections[0].request('stats')
+    for client in connections:
+        await client.close()
+    return seconds, latencies, serverStats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-game HTTP/WebSocket server and load tester")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    commands = parser.add_subparsers(dest='command', required=True)
+    serveParser = commands.add_parser('serve', help="run the game server")
+    serveParser.add_argument('--directory', default=DEFAULT_DIRECTORY, help="where idle games are written")
+    serveParser.add_argument('--live', type=int, default=1024, help="positions kept ready in memory")
+    serveParser.add_argument('--idle', type=float, default=300.0, help="seconds before an idle game goes to disk")
+    loadParser = commands.add_parser('load', help="simulate many clients against a running server")
+    loadParser.add_argument('--clients', type=int, default=100, help="connections")
+    loadParser.add_argument('--games', type=int, default=1000, help="games played at the same time")
+    loadParser.add_argument('--plies', type=int, default=40, help="moves per game at most")
+    loadParser.add_argument('--http', action='store_true', help="plain HTTP instead of WebSocket")
+    loadParser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        try:
+            asyncio.run(serve(args.host, args.port, GameStore(args.directory, args.live, args.idle)))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    seconds, latencies, serverStats = asyncio.run(loadTest(args.host, args.port, args.clients, args.games,
+                                                           args.plies, args.http, args.seed))
+    total = sum(len(samples) for op, samples in latencies.items() if op != 'errors')
+    print("%d requests in %.3fs (%.0f/s), %d errors" % (total, seconds, total / seconds if seconds else 0,
+                                                        len(latencies['errors'])))
+    for op in ('new', 'legal', 'move', 'state'):
+        p = percentiles(latencies[op])
+        if p['count']:
+            print("  %-6s %7d  p50 %7.3f ms  p95 %7.3f ms  p99 %7.3f ms  max %7.3f ms" % (
+                op, p['count'], p['p50ms'], p['p95ms'], p['p99ms'], p['maxms']))
+    print("server:", json.dumps(serverStats))
+
+
+if __name__ == "__main__":
+    main()
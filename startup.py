@@ -0,0 +1,51 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Cold-start benchmark: how long a fresh interpreter takes to import each module and to generate the first moves,
+# which is what every short-lived worker pays on top of the interpreter itself. Times are medians over several runs,
+# measured inside the child process. Compile the sources first (python -m compileall .) or the numbers include
+# compiling them.
+
+scenarios = [
+    ('import engine', "import engine"),
+    ('import bitboard', "import bitboard"),
+    ('import search', "import search"),
+    ('import perft', "import perft"),
+    ('import analysis', "import analysis"),
+    ('first bitboard getValid', "import bitboard; bitboard.BitboardGameState().getValid()"),
+    ('first numpy getValid', "import engine; engine.GameState().getValid()"),
+]
+
+
+def timeCommand(code, runs):
+    # median wall time of `python -c code` in milliseconds
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', 'import time; s = time.perf_counter(); ' + code +
+                                 '; print(time.perf_counter() - s)'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        samples.append(float(result.stdout.split()[-1]) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import and first-move latency")
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--budget', type=float, help="exit with status 1 if any import takes longer (ms)")
+    args = parser.parse_args()
+
+    failed = False
+    for name, code in scenarios:
+        ms = timeCommand(code, args.runs)
+        over = args.budget is not None and name.startswith('import') and ms > args.budget
+        failed = failed or over
+        print("%-26s %8.1f ms %s" % (name, ms, 'OVER BUDGET' if over else ''))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import os
+from array import array
+
+# Attack and ray lookup tables shared by every move generator, built once per process.
+# Squares are numbered row*8 + col (bit 0 is a8, bit 63 is h1) and directions use the checkPinsChecks order.
+# The bitboard tables are cached in a binary file next to this module so later imports just read them back.
+
+# UP, LEFT, DOWN, RIGHT, UL, UR, DL, DR
+directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+rookDirections = (0, 1, 2, 3)
+bishopDirections = (4, 5, 6, 7)
+queenDirections = (0, 1, 2, 3, 4, 5, 6, 7)
+# directions that walk towards higher square numbers, the nearest blocker on those rays is the lowest set bit
+positiveDirections = (False, False, True, True, False, False, True, True)
+knightSteps = ((-1, -2), (-2, -1), (-1, 2), (-2, 1), (1, 2), (2, 1), (1, -2), (2, -1))
+
+CACHE_VERSION = 1
+cachePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__', 'tables-v%d.bin' % CACHE_VERSION)
+# knight, king, white pawn, black pawn, 8 ray tables, between, line
+TABLE_SIZES = [64, 64, 64, 64] + [64] * 8 + [64 * 64, 64 * 64]
+
+
+def bitsOf(bb):
+    # yields the square number of every set bit, lowest first
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+
+def stepAttacks(steps):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        bb = 0
+        for dr, dc in steps:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                bb |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(bb)
+    return table
+
+
+def buildTables():
+    rays = [[0] * 64 for _ in directions]
+    between = [0] * (64 * 64)
+    line = [0] * (64 * 64)
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        for d, (dr, dc) in enumerate(directions):
+            passed = 0
+            for i in range(1, 8):
+                endRow, endCol = r + dr * i, c + dc * i
+                if not (0 <= endRow < 8 and 0 <= endCol < 8):
+                    break
+                target = endRow * 8 + endCol
+                between[sq * 64 + target] = passed
+                passed |= 1 << target
+            rays[d][sq] = passed
+    for sq in range(64):
+        for d in range(8):
+            opposite = d ^ 2 if d < 4 else 11 - d
+            full = rays[d][sq] | rays[opposite][sq] | (1 << sq)
+            for target in bitsOf(rays[d][sq]):
+                line[sq * 64 + target] = full
+    return [stepAttacks(knightSteps), stepAttacks(directions),
+            stepAttacks(((-1, -1), (-1, 1))), stepAttacks(((1, -1), (1, 1)))] + rays + [between, line]
+
+
+def loadTables():
+    # returns the flat tables from the cache file, building (and trying to write) it when missing or stale
+    data = array('Q')
+    try:
+        with open(cachePath, 'rb') as f:
+            data.fromfile(f, sum(TABLE_SIZES))
+    except (OSError, EOFError, ValueError):
+        data = array('Q', [x for table in buildTables() for x in table])
+        try:
+            os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+            with open(cachePath, 'wb') as f:
+                data.tofile(f)
+        except OSError:
+            pass  # read-only install, just build them every time
+    tables = []
+    offset = 0
+    for size in TABLE_SIZES:
+        tables.append(data[offset:offset + size].tolist())
+        offset += size
+    return tables
+
+
+_tables = loadTables()
+
+# bitboard tables, indexed by square number
+knightAttacks = _tables[0]
+kingAttacks = _tables[1]
+pawnAttacks = {'w': _tables[2], 'b': _tables[3]}  # squares a pawn of that colour attacks
+rays = _tables[4:12]  # rays[d][sq]: every square from sq (exclusive) to the edge in direction d
+# between[a][b]: squares strictly between two aligned squares (check blocking), line[a][b]: the whole line through
+# them (pins). Both are 0 for squares that don't share a line.
+between = [_tables[12][sq * 64:sq * 64 + 64] for sq in range(64)]
+line = [_tables[13][sq * 64:sq * 64 + 64] for sq in range(64)]
+del _tables
+
+
+def squaresOf(bb, reverse=False):
+    squares = [divmod(sq, 8) for sq in bitsOf(bb)]
+    return tuple(reversed(squares)) if reverse else tuple(squares)
+
+
+# (row, col) forms for the NumPy generator in engine.py, indexed [row][col] like GameState.board
+knightSquares = [[squaresOf(knightAttacks[r * 8 + c]) for c in range(8)] for r in range(8)]
+kingSquares = [[squaresOf(kingAttacks[r * 8 + c]) for c in range(8)] for r in range(8)]
+# raySquares[row][col][d]: squares along direction d, nearest first
+raySquares = [[tuple(squaresOf(rays[d][r * 8 + c], not positiveDirections[d]) for d in range(8))
+               for c in range(8)] for r in range(8)]
+
+
+def slidingAttacks(sq, occupancy, dirs):
+    attacks = 0
+    for d in dirs:
+        ray = rays[d][sq]
+        blockers = ray & occupancy
+        if blockers:
+            if positiveDirections[d]:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= rays[d][blocker]
+        attacks |= ray
+    return attacks
@@ -0,0 +1,17 @@
+import movecode
+from bitboard import BitboardGameState
+from engine import Moves
+
+
+def test_moves_made_by_code_are_stored_as_moves():
+    gs = BitboardGameState()
+    buffer = movecode.newMoveList()
+    codes = [buffer[i] for i in range(gs.generateMoves(buffer))]
+    gs.makeMove(next(code for code in codes if movecode.notation(code) == 'e2e4'))
+    gs.makeMove(next(m for m in gs.getValid() if m.getNotation() == 'd7d5'))
+    assert all(isinstance(move, Moves) for move in gs.moves)
+    assert gs.moves[0].getNotation() == 'e2e4' and gs.moves[0].pieceMoved == 'wp'
+    gs.makeMove(movecode.encode(36, 27))
+    assert gs.moves[-1].pieceCaptured == 'bp'
+    gs.undoMove()
+    assert gs.mailbox[3][3] == 'bp' and gs.mailbox[4][4] == 'wp'
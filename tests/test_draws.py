@@ -0,0 +1,69 @@
+import pytest
+
+import zobrist
+from bitboard import BitboardGameState
+from engine import GameState
+
+backends = [GameState, BitboardGameState]
+
+
+def play(gs, *notations):
+    for notation in notations:
+        gs.makeMove(next(m for m in gs.getValid() if m.getNotation() == notation))
+
+
+@pytest.mark.parametrize('backend', backends)
+def test_knight_shuffle_repeats(backend):
+    gs = backend()
+    play(gs, 'g1f3', 'g8f6', 'f3g1', 'f6g8')
+    assert gs.isRepetition(2) and not gs.isRepetition(3)
+    play(gs, 'g1f3', 'g8f6', 'f3g1', 'f6g8')
+    gs.CheckForMate()
+    assert gs.drawReason == 'threefold repetition'
+    gs.undoMove()
+    gs.CheckForMate()
+    assert gs.drawReason is None
+
+
+@pytest.mark.parametrize('backend', backends)
+def test_repetition_after_untakeable_double_push(backend):
+    # after e2e4 no black pawn can take en passant, so the position after the first f3g1 is the same as the two
+    # later ones even though only the first has an en passant square
+    gs = backend()
+    play(gs, 'e2e4', 'g8f6', 'g1f3', 'f6g8', 'f3g1', 'g8f6', 'g1f3', 'f6g8', 'f3g1')
+    assert gs.isRepetition(3)
+    gs.CheckForMate()
+    assert gs.drawReason == 'threefold repetition'
+
+
+@pytest.mark.parametrize('backend', backends)
+def test_takeable_en_passant_changes_the_hash(backend):
+    gs = backend("4k3/8/8/8/5p2/8/4P3/4K3 w - - 0 1")
+    play(gs, 'e2e4')
+    assert gs.zobristHash != backend("4k3/8/8/8/4Pp2/8/8/4K3 b - - 0 1").zobristHash
+    assert gs.zobristHash == backend("4k3/8/8/8/4Pp2/8/8/4K3 b - e3 0 1").zobristHash
+    gs = backend("4k3/8/8/8/8/8/4P3/4K3 w - - 0 1")
+    play(gs, 'e2e4')
+    assert gs.zobristHash == backend("4k3/8/8/8/4P3/8/8/4K3 b - - 0 1").zobristHash
+
+
+@pytest.mark.parametrize('backend', backends)
+def test_incremental_hash_matches_full_hash(backend):
+    gs = backend()
+    line = ['e2e4', 'd7d5', 'e4e5', 'f7f5', 'e5f6', 'g7f6', 'd2d4', 'c7c5', 'd4c5', 'e7e5', 'c5c6', 'b7b5']
+    for notation in line:
+        play(gs, notation)
+        assert gs.zobristHash == zobrist.hashPosition(gs)
+    for _ in line:
+        gs.undoMove()
+        assert gs.zobristHash == zobrist.hashPosition(gs)
+
+
+@pytest.mark.parametrize('backend', backends)
+def test_piece_count_follows_captures(backend):
+    gs = backend()
+    assert gs.pieceCount == 32
+    play(gs, 'e2e4', 'd7d5', 'e4d5')
+    assert gs.pieceCount == 31
+    gs.undoMove()
+    assert gs.pieceCount == 32
@@ -0,0 +1,22 @@
+import io
+
+import pgn
+
+
+def test_rest_of_line_comment_ends_at_newline():
+    source = io.StringIO('[Event "x"]\n[Result "1-0"]\n\n1. e4 e5 ; comment\n2. Nf3 Nc6 3. Bb5 1-0\n')
+    (headers, movetext), = pgn.readGames(source)
+    assert headers['Result'] == '1-0'
+    assert list(pgn.sanTokens(movetext)) == ['e4', 'e5', 'Nf3', 'Nc6', 'Bb5']
+
+
+def test_comments_variations_and_glyphs_are_skipped():
+    movetext = '1. e4 {best by test} e5 (1... c5 2. Nf3 (2. c3) d6) 2. Nf3 $1 Nc6 1/2-1/2'
+    assert list(pgn.sanTokens(movetext)) == ['e4', 'e5', 'Nf3', 'Nc6']
+
+
+def test_replay_reaches_the_last_move():
+    source = io.StringIO('[Event "x"]\n\n1. e4 e5 ; the rest still counts\n2. Nf3 Nc6 3. Bb5 a6 *\n')
+    (headers, movetext), = pgn.readGames(source)
+    sans = [san for _, _, san in pgn.replay(headers, movetext)]
+    assert sans == ['e4', 'e5', 'Nf3', 'Nc6', 'Bb5', 'a6']
@@ -0,0 +1,14 @@
+from engine import GameState
+from polyglot import decodeMove
+
+E1H1 = 7 | 4 << 6  # from e1 to h1, the way polyglot books store white's short castle
+
+
+def test_king_to_own_rook_decodes_as_castling():
+    gs = GameState('4k3/8/8/8/8/8/8/4K2R w K - 0 1')
+    assert decodeMove(E1H1, gs.boardRows()) == 'e1g1'
+
+
+def test_rook_move_is_not_taken_for_castling():
+    gs = GameState('4k3/8/8/8/8/8/8/K3R3 w - - 0 1')
+    assert decodeMove(E1H1, gs.boardRows()) == 'e1h1'
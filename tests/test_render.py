@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+p = pytest.importorskip('pygame')
+
+import engine
+import main as ui
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    monkeypatch.chdir(repoDir)  # loadimages reads images/ relative to the repo
+    p.init()
+    screen = p.display.set_mode((ui.width, ui.height))
+    ui.loadimages()
+    yield ui.BoardRenderer(screen)
+    p.quit()
+
+
+def squaresOf(rects):
+    return sorted((rect.y // ui.square_size, rect.x // ui.square_size) for rect in rects)
+
+
+def play(gs, notation):
+    gs.makeMove(next(m for m in gs.getValid() if m.getNotation() == notation))
+
+
+def test_first_draw_repaints_everything(renderer):
+    gs = engine.GameState()
+    assert len(renderer.draw(gs, gs.getValid(), (), None)) == 64
+
+
+def test_nothing_changed_draws_nothing(renderer):
+    gs = engine.GameState()
+    renderer.draw(gs, gs.getValid(), (), None)
+    assert renderer.draw(gs, gs.getValid(), (), None) == []
+
+
+def test_selection_redraws_the_piece_and_its_targets(renderer):
+    gs = engine.GameState()
+    validMoves = gs.getValid()
+    renderer.draw(gs, validMoves, (), None)
+    assert squaresOf(renderer.draw(gs, validMoves, (6, 4), None)) == [(4, 4), (5, 4), (6, 4)]
+    assert squaresOf(renderer.draw(gs, validMoves, (), None)) == [(4, 4), (5, 4), (6, 4)]
+
+
+def test_move_redraws_start_and_end_square(renderer):
+    gs = engine.GameState()
+    renderer.draw(gs, gs.getValid(), (), None)
+    play(gs, 'g1f3')
+    assert squaresOf(renderer.draw(gs, gs.getValid(), (), None)) == [(5, 5), (7, 6)]
+
+
+def test_dirty_square_matches_a_full_repaint(renderer):
+    gs = engine.GameState()
+    renderer.draw(gs, gs.getValid(), (), None)
+    play(gs, 'e2e4')
+    renderer.draw(gs, gs.getValid(), (), None)
+    incremental = p.image.tobytes(renderer.screen, 'RGB')
+    renderer.invalidate()
+    assert len(renderer.draw(gs, gs.getValid(), (), None)) == 64
+    assert p.image.tobytes(renderer.screen, 'RGB') == incremental
+
+
+def test_status_text_forces_a_full_repaint(renderer):
+    gs = engine.GameState()
+    renderer.draw(gs, gs.getValid(), (), None)
+    assert len(renderer.draw(gs, gs.getValid(), (), None, 'Draw by threefold repetition')) == 64
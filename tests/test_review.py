@@ -0,0 +1,10 @@
+from engine import GameState
+from review import gamePositions, moveLabel
+
+
+def test_move_labels_follow_the_start_position():
+    gs = GameState('4k3/8/8/8/8/8/4P3/4K3 b - - 3 40')
+    for notation in ('e8d8', 'e2e4', 'd8e8'):
+        gs.makeMove(next(m for m in gs.getValid() if m.getNotation() == notation))
+    fens, notations, _ = gamePositions(gs)
+    assert [moveLabel(fen) for fen in fens[:3]] == ['40...', '41.', '41...']
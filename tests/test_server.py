@@ -0,0 +1,31 @@
+import pytest
+
+import server
+
+
+@pytest.fixture
+def store(tmp_path):
+    return server.GameStore(str(tmp_path))
+
+
+@pytest.mark.parametrize('fen', [
+    'P3k3/8/8/8/8/8/8/4K3 w - - 0 1',  # pawn on the eighth rank
+    '4k3/8/8/8/8/8/8/p3K3 b - - 0 1',  # pawn on the first rank
+    '4k3/8/8/8/8/8/8/8 w - - 0 1',  # no white king
+    '4k3/8/8/8/8/8/8/K3K3 w - - 0 1',  # two white kings
+    '4k3/8/8/8/8/8/8/4R1K1 w - - 0 1',  # black in check with white to move
+    'not a fen',
+])
+def test_unplayable_fen_leaves_no_game(store, tmp_path, fen):
+    with pytest.raises(server.ServiceError):
+        store.create(fen)
+    assert store.sessions == {} and len(store.live) == 0
+    store.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_create_and_move(store):
+    game = store.create()
+    assert game['status'] == 'ongoing' and game['id'] in store.sessions
+    assert store.move(game['id'], 'e2e4')['turn'] == 'b'
+    assert store.state(game['id'])['moves'] == ['e2e4']
@@ -0,0 +1,58 @@
+import random
+
+# Zobrist keys: one random 64-bit number per (piece, square), per castling right, per en passant file and for
+# black to move. A position's hash is the XOR of the keys of everything in it, so makeMove can update it by
+# XOR-ing out what changed and XOR-ing in the new state instead of rehashing the whole board.
+# The generator is seeded so the same position hashes to the same value in every process.
+
+_rng = random.Random(0x5A0B1157)
+
+pieceKeys = {}
+for _piece in ['wp', 'wn', 'wb', 'wr', 'wq', 'wk', 'bp', 'bn', 'bb', 'br', 'bq', 'bk']:
+    pieceKeys[_piece] = [_rng.getrandbits(64) for _ in range(64)]  # indexed by row*8 + col
+castleKeys = {'wks': _rng.getrandbits(64), 'wqs': _rng.getrandbits(64),
+              'bks': _rng.getrandbits(64), 'bqs': _rng.getrandbits(64)}
+enPassantKeys = [_rng.getrandbits(64) for _ in range(8)]  # indexed by column
+blackToMoveKey = _rng.getrandbits(64)
+
+
+def castleHash(rights):
+    h = 0
+    if rights.wks:
+        h ^= castleKeys['wks']
+    if rights.wqs:
+        h ^= castleKeys['wqs']
+    if rights.bks:
+        h ^= castleKeys['bks']
+    if rights.bqs:
+        h ^= castleKeys['bqs']
+    return h
+
+
+def enPassantHash(board, possibleEnPassant, whiteMove):
+    # the en passant file only counts when a pawn of the side to move stands beside the pawn that just moved (the
+    # Polyglot rule), so a double push nobody can take leaves the same hash as reaching that position any other way
+    # and repetitions are still found. board is anything indexed [row][col].
+    if not possibleEnPassant:
+        return 0
+    r, c = possibleEnPassant
+    pawn, row = ('wp', board[r + 1]) if whiteMove else ('bp', board[r - 1])
+    if (c > 0 and row[c - 1] == pawn) or (c < 7 and row[c + 1] == pawn):
+        return enPassantKeys[c]
+    return 0
+
+
+def hashPosition(gs):
+    # full hash from scratch, used when a position is set up and to check the incremental one
+    h = 0
+    board = gs.boardRows()
+    for r in range(8):
+        for c in range(8):
+            piece = board[r][c]
+            if piece != '--':
+                h ^= pieceKeys[piece][r * 8 + c]
+    h ^= castleHash(gs.currentCastleRights)
+    h ^= enPassantHash(board, gs.possibleEnPassant, gs.whiteMove)
+    if not gs.whiteMove:
+        h ^= blackToMoveKey
+    return h